@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\x04\x63hat\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"1\n\rLoginResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"H\n\x12SendMessageRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"7\n\x13SendMessageResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"?\n\x19ReadUnreadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08per_page\x18\x02 \x01(\x05\"=\n\x1aReadUnreadMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\"\'\n\x13ReadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"7\n\x14ReadMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\",\n\x18GetUnreadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"C\n\x19GetUnreadMessagesResponse\x12&\n\x0funread_messages\x18\x01 \x03(\x0b\x32\r.chat.Message\"$\n\x13ListAccountsRequest\x12\r\n\x05query\x18\x01 \x01(\t\"-\n\x14ListAccountsResponse\x12\x15\n\rlist_accounts\x18\x01 \x03(\t\"V\n\x14\x44\x65leteMessageRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x0b\n\x03idx\x18\x04 \x01(\x05\"9\n\x15\x44\x65leteMessageResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"(\n\x14\x44\x65leteAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"9\n\x15\x44\x65leteAccountResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"*\n\x07Message\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\t2\xd4\x04\n\x0b\x43hatService\x12\x30\n\x05Login\x12\x12.chat.LoginRequest\x1a\x13.chat.LoginResponse\x12\x42\n\x0bSendMessage\x12\x18.chat.SendMessageRequest\x1a\x19.chat.SendMessageResponse\x12W\n\x12ReadUnreadMessages\x12\x1f.chat.ReadUnreadMessagesRequest\x1a .chat.ReadUnreadMessagesResponse\x12\x45\n\x0cReadMessages\x12\x19.chat.ReadMessagesRequest\x1a\x1a.chat.ReadMessagesResponse\x12T\n\x11GetUnreadMessages\x12\x1e.chat.GetUnreadMessagesRequest\x1a\x1f.chat.GetUnreadMessagesResponse\x12\x45\n\x0cListAccounts\x12\x19.chat.ListAccountsRequest\x1a\x1a.chat.ListAccountsResponse\x12H\n\rDeleteMessage\x12\x1a.chat.DeleteMessageRequest\x1a\x1b.chat.DeleteMessageResponse\x12H\n\rDeleteAccount\x12\x1a.chat.DeleteAccountRequest\x1a\x1b.chat.DeleteAccountResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\x04\x63hat\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"1\n\rLoginResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"H\n\x12SendMessageRequest\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x11\n\trecipient\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"7\n\x13SendMessageResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"?\n\x19ReadUnreadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08per_page\x18\x02 \x01(\x05\"=\n\x1aReadUnreadMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\"\'\n\x13ReadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"7\n\x14ReadMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\",\n\x18GetUnreadMessagesRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"C\n\x19GetUnreadMessagesResponse\x12&\n\x0funread_messages\x18\x01 \x03(\x0b\x32\r.chat.Message\"$\n\x13ListAccountsRequest\x12\r\n\x05query\x18\x01 \x01(\t\"-\n\x14ListAccountsResponse\x12\x15\n\rlist_accounts\x18\x01 \x03(\t\"b\n\x14\x44\x65leteMessageRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x0b\n\x03idx\x18\x04 \x01(\x05\x12\n\n\x02id\x18\x05 \x01(\x03\"9\n\x15\x44\x65leteMessageResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"(\n\x14\x44\x65leteAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"9\n\x15\x44\x65leteAccountResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"*\n\x16SubscribeUnreadRequest\x12\x10\n\x08username\x18\x01 \x01(\t\"\x1c\n\x0bUnreadCount\x12\r\n\x05\x63ount\x18\x01 \x01(\x05\"\xc2\x03\n\nAnyRequest\x12#\n\x05login\x18\x01 \x01(\x0b\x32\x12.chat.LoginRequestH\x00\x12\x30\n\x0csend_message\x18\x02 \x01(\x0b\x32\x18.chat.SendMessageRequestH\x00\x12?\n\x14read_unread_messages\x18\x03 \x01(\x0b\x32\x1f.chat.ReadUnreadMessagesRequestH\x00\x12\x32\n\rread_messages\x18\x04 \x01(\x0b\x32\x19.chat.ReadMessagesRequestH\x00\x12=\n\x13get_unread_messages\x18\x05 \x01(\x0b\x32\x1e.chat.GetUnreadMessagesRequestH\x00\x12\x32\n\rlist_accounts\x18\x06 \x01(\x0b\x32\x19.chat.ListAccountsRequestH\x00\x12\x34\n\x0e\x64\x65lete_message\x18\x07 \x01(\x0b\x32\x1a.chat.DeleteMessageRequestH\x00\x12\x34\n\x0e\x64\x65lete_account\x18\x08 \x01(\x0b\x32\x1a.chat.DeleteAccountRequestH\x00\x42\t\n\x07request\"\xcc\x03\n\x0b\x41nyResponse\x12$\n\x05login\x18\x01 \x01(\x0b\x32\x13.chat.LoginResponseH\x00\x12\x31\n\x0csend_message\x18\x02 \x01(\x0b\x32\x19.chat.SendMessageResponseH\x00\x12@\n\x14read_unread_messages\x18\x03 \x01(\x0b\x32 .chat.ReadUnreadMessagesResponseH\x00\x12\x33\n\rread_messages\x18\x04 \x01(\x0b\x32\x1a.chat.ReadMessagesResponseH\x00\x12>\n\x13get_unread_messages\x18\x05 \x01(\x0b\x32\x1f.chat.GetUnreadMessagesResponseH\x00\x12\x33\n\rlist_accounts\x18\x06 \x01(\x0b\x32\x1a.chat.ListAccountsResponseH\x00\x12\x35\n\x0e\x64\x65lete_message\x18\x07 \x01(\x0b\x32\x1b.chat.DeleteMessageResponseH\x00\x12\x35\n\x0e\x64\x65lete_account\x18\x08 \x01(\x0b\x32\x1b.chat.DeleteAccountResponseH\x00\x42\n\n\x08response\"2\n\x0c\x42\x61tchRequest\x12\"\n\x08requests\x18\x01 \x03(\x0b\x32\x10.chat.AnyRequest\"5\n\rBatchResponse\x12$\n\tresponses\x18\x01 \x03(\x0b\x32\x11.chat.AnyResponse\"6\n\x07Message\x12\x0e\n\x06sender\x18\x01 \x01(\t\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\n\n\x02id\x18\x03 \x01(\x03\x32\xcc\x05\n\x0b\x43hatService\x12\x30\n\x05Login\x12\x12.chat.LoginRequest\x1a\x13.chat.LoginResponse\x12\x42\n\x0bSendMessage\x12\x18.chat.SendMessageRequest\x1a\x19.chat.SendMessageResponse\x12W\n\x12ReadUnreadMessages\x12\x1f.chat.ReadUnreadMessagesRequest\x1a .chat.ReadUnreadMessagesResponse\x12\x45\n\x0cReadMessages\x12\x19.chat.ReadMessagesRequest\x1a\x1a.chat.ReadMessagesResponse\x12T\n\x11GetUnreadMessages\x12\x1e.chat.GetUnreadMessagesRequest\x1a\x1f.chat.GetUnreadMessagesResponse\x12\x45\n\x0cListAccounts\x12\x19.chat.ListAccountsRequest\x1a\x1a.chat.ListAccountsResponse\x12H\n\rDeleteMessage\x12\x1a.chat.DeleteMessageRequest\x1a\x1b.chat.DeleteMessageResponse\x12H\n\rDeleteAccount\x12\x1a.chat.DeleteAccountRequest\x1a\x1b.chat.DeleteAccountResponse\x12\x44\n\x0fSubscribeUnread\x12\x1c.chat.SubscribeUnreadRequest\x1a\x11.chat.UnreadCount0\x01\x12\x30\n\x05\x42\x61tch\x12\x12.chat.BatchRequest\x1a\x13.chat.BatchResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -56,15 +56,27 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_LISTACCOUNTSRESPONSE']._serialized_start=633
   _globals['_LISTACCOUNTSRESPONSE']._serialized_end=678
   _globals['_DELETEMESSAGEREQUEST']._serialized_start=680
-  _globals['_DELETEMESSAGEREQUEST']._serialized_end=766
-  _globals['_DELETEMESSAGERESPONSE']._serialized_start=768
-  _globals['_DELETEMESSAGERESPONSE']._serialized_end=825
-  _globals['_DELETEACCOUNTREQUEST']._serialized_start=827
-  _globals['_DELETEACCOUNTREQUEST']._serialized_end=867
-  _globals['_DELETEACCOUNTRESPONSE']._serialized_start=869
-  _globals['_DELETEACCOUNTRESPONSE']._serialized_end=926
-  _globals['_MESSAGE']._serialized_start=928
-  _globals['_MESSAGE']._serialized_end=970
-  _globals['_CHATSERVICE']._serialized_start=973
-  _globals['_CHATSERVICE']._serialized_end=1569
+  _globals['_DELETEMESSAGEREQUEST']._serialized_end=778
+  _globals['_DELETEMESSAGERESPONSE']._serialized_start=780
+  _globals['_DELETEMESSAGERESPONSE']._serialized_end=837
+  _globals['_DELETEACCOUNTREQUEST']._serialized_start=839
+  _globals['_DELETEACCOUNTREQUEST']._serialized_end=879
+  _globals['_DELETEACCOUNTRESPONSE']._serialized_start=881
+  _globals['_DELETEACCOUNTRESPONSE']._serialized_end=938
+  _globals['_SUBSCRIBEUNREADREQUEST']._serialized_start=940
+  _globals['_SUBSCRIBEUNREADREQUEST']._serialized_end=982
+  _globals['_UNREADCOUNT']._serialized_start=984
+  _globals['_UNREADCOUNT']._serialized_end=1012
+  _globals['_ANYREQUEST']._serialized_start=1015
+  _globals['_ANYREQUEST']._serialized_end=1465
+  _globals['_ANYRESPONSE']._serialized_start=1468
+  _globals['_ANYRESPONSE']._serialized_end=1928
+  _globals['_BATCHREQUEST']._serialized_start=1930
+  _globals['_BATCHREQUEST']._serialized_end=1980
+  _globals['_BATCHRESPONSE']._serialized_start=1982
+  _globals['_BATCHRESPONSE']._serialized_end=2035
+  _globals['_MESSAGE']._serialized_start=2037
+  _globals['_MESSAGE']._serialized_end=2091
+  _globals['_CHATSERVICE']._serialized_start=2094
+  _globals['_CHATSERVICE']._serialized_end=2810
 # @@protoc_insertion_point(module_scope)
@@ -74,6 +74,16 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.DeleteAccountRequest.SerializeToString,
                 response_deserializer=chat__pb2.DeleteAccountResponse.FromString,
                 _registered_method=True)
+        self.SubscribeUnread = channel.unary_stream(
+                '/chat.ChatService/SubscribeUnread',
+                request_serializer=chat__pb2.SubscribeUnreadRequest.SerializeToString,
+                response_deserializer=chat__pb2.UnreadCount.FromString,
+                _registered_method=True)
+        self.Batch = channel.unary_unary(
+                '/chat.ChatService/Batch',
+                request_serializer=chat__pb2.BatchRequest.SerializeToString,
+                response_deserializer=chat__pb2.BatchResponse.FromString,
+                _registered_method=True)
 
 
 class ChatServiceServicer(object):
@@ -127,6 +137,18 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SubscribeUnread(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Batch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ChatServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -170,6 +192,16 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.DeleteAccountRequest.FromString,
                     response_serializer=chat__pb2.DeleteAccountResponse.SerializeToString,
             ),
+            'SubscribeUnread': grpc.unary_stream_rpc_method_handler(
+                    servicer.SubscribeUnread,
+                    request_deserializer=chat__pb2.SubscribeUnreadRequest.FromString,
+                    response_serializer=chat__pb2.UnreadCount.SerializeToString,
+            ),
+            'Batch': grpc.unary_unary_rpc_method_handler(
+                    servicer.Batch,
+                    request_deserializer=chat__pb2.BatchRequest.FromString,
+                    response_serializer=chat__pb2.BatchResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'chat.ChatService', rpc_method_handlers)
@@ -396,3 +428,57 @@ class ChatService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def SubscribeUnread(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/chat.ChatService/SubscribeUnread',
+            chat__pb2.SubscribeUnreadRequest.SerializeToString,
+            chat__pb2.UnreadCount.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Batch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/Batch',
+            chat__pb2.BatchRequest.SerializeToString,
+            chat__pb2.BatchResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -1,30 +1,81 @@
 import grpc
 import tkinter as tk
 from tkinter import messagebox
-import hashlib
+import os
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb") # use the C protobuf runtime; must be set before importing chat_pb2
 import chat_pb2
 import chat_pb2_grpc
 import configparser
+import threading
+import itertools
+
+# the field of chat_pb2.AnyRequest that holds each type of request
+BATCH_FIELDS = {
+    'LoginRequest': 'login',
+    'SendMessageRequest': 'send_message',
+    'ReadUnreadMessagesRequest': 'read_unread_messages',
+    'ReadMessagesRequest': 'read_messages',
+    'GetUnreadMessagesRequest': 'get_unread_messages',
+    'ListAccountsRequest': 'list_accounts',
+    'DeleteMessageRequest': 'delete_message',
+    'DeleteAccountRequest': 'delete_account',
+}
+
+CHANNEL_POOL_SIZE = 4 # number of connections to the server, used in turn by the RPCs
 
 class Client:
     """
     A client for a chat application, handling communication with the server.
     """
-    def __init__(self, host='127.0.0.1', port=5555):
+    def __init__(self, host='127.0.0.1', port=5555, channels=None):
         """
         Initializes the Client instance and establishes a connection to the server.
         
         Args:
             host (str): The server's hostname or IP address.
             port (int): The port number to connect to.
-        """
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-        host = config['server']['host']
-        port = int(config['server']['port'])
-        self.channel = grpc.insecure_channel(f'{host}:{port}')
-        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+            channels (list): The channels of another client to share, so no new connections are opened.
+        """
+        if channels is None:
+            config = configparser.ConfigParser()
+            config.read('config.ini')
+            host = config['server']['host']
+            port = int(config['server']['port'])
+            # each channel gets its own connection, so concurrent RPCs are not queued behind each other on one connection
+            channels = [grpc.insecure_channel(f'{host}:{port}', options=[('grpc.use_local_subchannel_pool', 1)]) for _ in range(CHANNEL_POOL_SIZE)]
+        self.channels = channels
+        self.stubs = [chat_pb2_grpc.ChatServiceStub(channel) for channel in self.channels]
+        self.rpc_count = itertools.count()
         self.username = None
+        self.read_message_ids = [] # ids of the messages returned by the last read_messages call
+        self.user_requests = {} # requests that only carry the username, reused while the user stays the same
+
+    @property
+    def stub(self):
+        """
+        Picks the stub of the next channel in the pool, round-robin.
+        
+        Returns:
+            chat_pb2_grpc.ChatServiceStub: The stub to send the next RPC with.
+        """
+        return self.stubs[next(self.rpc_count) % CHANNEL_POOL_SIZE]
+
+    def user_request(self, request_type):
+        """
+        Gets a request that only carries the current username, building it once per user.
+        Requests are not mutated after they are sent, so the same message can be resent.
+        
+        Args:
+            request_type (type): The chat_pb2 request class, e.g. chat_pb2.ReadMessagesRequest.
+        
+        Returns:
+            The request for the current user.
+        """
+        request = self.user_requests.get(request_type)
+        if request is None or request.username != self.username:
+            request = request_type(username=self.username)
+            self.user_requests[request_type] = request
+        return request
 
     def send_message(self, recipient, message):
         """
@@ -60,7 +111,8 @@ class Client:
         Returns:
             list: A list of read messages, each represented as a dictionary.
         """
-        response = self.stub.ReadMessages(chat_pb2.ReadMessagesRequest(username=self.username))
+        response = self.stub.ReadMessages(self.user_request(chat_pb2.ReadMessagesRequest))
+        self.read_message_ids = [msg.id for msg in response.messages]
         return [{'sender': msg.sender, 'message': msg.message} for msg in response.messages]
 
     def get_unread(self):
@@ -70,9 +122,48 @@ class Client:
         Returns:
             list: A list of unread messages, each represented as a dictionary.
         """
-        response = self.stub.GetUnreadMessages(chat_pb2.GetUnreadMessagesRequest(username=self.username))
+        response = self.stub.GetUnreadMessages(self.user_request(chat_pb2.GetUnreadMessagesRequest))
         return [{'sender': msg.sender, 'message': msg.message} for msg in response.unread_messages]
 
+    def check_messages(self):
+        """
+        Request the unread and the read messages of the current user together, in a single call.
+        
+        Returns:
+            tuple: The list of unread messages and the list of read messages, each message represented as a dictionary.
+        """
+        unread_response, read_response = self.batch([self.user_request(chat_pb2.GetUnreadMessagesRequest),
+                                                     self.user_request(chat_pb2.ReadMessagesRequest)])
+        self.read_message_ids = [msg.id for msg in read_response.messages]
+        return ([{'sender': msg.sender, 'message': msg.message} for msg in unread_response.unread_messages],
+                [{'sender': msg.sender, 'message': msg.message} for msg in read_response.messages])
+
+    def subscribe_unread(self):
+        """
+        Request to follow the unread messages count of the current user. The server sends the current count
+        and then a new count every time it changes.
+        
+        Returns:
+            grpc stream: An iterator of chat_pb2.UnreadCount; call its cancel() method to stop following.
+        """
+        return self.stub.SubscribeUnread(self.user_request(chat_pb2.SubscribeUnreadRequest))
+
+    def batch(self, requests):
+        """
+        Sends several requests to server in a single call and get their responses.
+        
+        Args:
+            requests (list): The requests to send, e.g. chat_pb2.SendMessageRequest objects.
+        
+        Returns:
+            list: The response to each request, in the same order.
+        """
+        batch_request = chat_pb2.BatchRequest()
+        for request in requests:
+            getattr(batch_request.requests.add(), BATCH_FIELDS[request.DESCRIPTOR.name]).CopyFrom(request)
+        response = self.stub.Batch(batch_request)
+        return [getattr(sub_response, sub_response.WhichOneof('response')) for sub_response in response.responses]
+
     def login(self, username, password):
         """
         Request to authenticate the user with the provided credentials and get response from server.
@@ -109,12 +200,13 @@ class Client:
         Args:
             sender (str): The sender of the message.
             message (str): The content of the message.
-            idx (int): The index of the message in the list.
+            idx (int): The index of the message in the list returned by read_messages.
         
         Returns:
             str: A success or failure message.
         """
-        response = self.stub.DeleteMessage(chat_pb2.DeleteMessageRequest(username=self.username, sender=sender, message=message, idx=idx))
+        msg_id = self.read_message_ids[idx] if idx < len(self.read_message_ids) else 0 # the server falls back to idx without an id
+        response = self.stub.DeleteMessage(chat_pb2.DeleteMessageRequest(username=self.username, sender=sender, message=message, idx=idx, id=msg_id))
         return response.message
 
     def delete_account(self):
@@ -124,7 +216,7 @@ class Client:
         Returns:
             str: A success or failure message.
         """
-        response = self.stub.DeleteAccount(chat_pb2.DeleteAccountRequest(username=self.username))
+        response = self.stub.DeleteAccount(self.user_request(chat_pb2.DeleteAccountRequest))
         return response.message
 
 class ChatApp:
@@ -142,6 +234,7 @@ class ChatApp:
         self.root = root
         self.root.geometry("600x350")
         self.client = Client()
+        self.unread_stream = None
         self.setup_login_page()
 
     def setup_login_page(self):
@@ -182,23 +275,13 @@ class ChatApp:
         tk.Button(self.root, text="Log in/Sign up", command=self.login).pack()
         tk.Button(self.root, text="Back", command=self.setup_login_page).pack()
 
-    def hash_password(self, password):
-        """
-        Hashes a password using SHA-256.
-        
-        Args:
-            password (str): The password to hash.
-        
-        Returns:
-            str: The hashed password.
-        """
-        return hashlib.sha256(password.encode()).hexdigest()
-
     def login(self):
         """
         Logs the user in or registers a new account if the username does not exist.
+        
+        The password is sent as entered; the server salts and hashes it.
         """
-        password = self.hash_password(self.password_entry.get())
+        password = self.password_entry.get()
         success = self.client.login(self.username, password)
         if success:
             self.setup_account_page()
@@ -218,16 +301,46 @@ class ChatApp:
         tk.Button(self.root, text="Read messages", command=self.read_messages).pack()
         tk.Button(self.root, text="Delete account", command=self.delete_account).pack()
         tk.Button(self.root, text="Log out", command=self.setup_login_page).pack()
-        self.refresh_unread_messages()
+        self.unread_stream = self.client.subscribe_unread()
+        threading.Thread(target=self.watch_unread_messages, args=(self.unread_stream,), daemon=True).start()
+
+    def watch_unread_messages(self, stream):
+        """
+        Follows the unread messages count pushed by the server in a background thread, to notify 
+        logged-in users about new undelivered messages immediately. 
 
-    def refresh_unread_messages(self):
+        Args:
+            stream (grpc stream): The SubscribeUnread stream of the current user.
+        """
+        try:
+            for update in stream:
+                self.root.after(0, self.show_unread_count, stream, update.count) # update the label on the Tk thread
+        except grpc.RpcError as e: # the stream is cancelled when leaving the account page
+            if e.code() == grpc.StatusCode.RESOURCE_EXHAUSTED: # the server has no stream to spare
+                self.root.after(0, self.poll_unread_count, stream)
+
+    def poll_unread_count(self, stream):
         """
-        Refreshes the unread messages count every second to notify logged-in users about new undelivered messages immediately. 
+        Refreshes the unread messages count every second, for when the server refused to push it.
+
+        Args:
+            stream (grpc stream): The refused stream, polling stops once the account page is left.
+        """
+        if stream is self.unread_stream:
+            self.show_unread_count(stream, len(self.client.get_unread()))
+            self.root.after(1000, self.poll_unread_count, stream)
+
+    def show_unread_count(self, stream, count):
         """
-        if hasattr(self, "unread_label") and self.unread_label.winfo_exists():
-            unread_messages = self.client.get_unread() 
-            self.unread_label.config(text=f"({len(unread_messages)} unread messages)")
-            self.root.after(1000, self.refresh_unread_messages)
+        Displays the unread messages count on the account page.
+
+        Args:
+            stream (grpc stream): The stream the count came from.
+            count (int): The number of unread messages.
+        """
+        # the stream is reset when leaving the account page, so stale updates are dropped without asking Tk
+        if stream is self.unread_stream:
+            self.unread_label.config(text=f"({count} unread messages)")
 
     def setup_list_accounts_page(self):
         """
@@ -308,13 +421,14 @@ class ChatApp:
 
         If there are unread messages, navigates to the unread messages 
         page. Otherwise, directs the user to the read messages result page.
+        The read messages are fetched in the same call, so that page needs no second round trip.
         """
-        unread_messages = self.client.get_unread()
+        unread_messages, read_messages = self.client.check_messages()
         num_unread = len(unread_messages)
         if num_unread > 0:
             self.setup_unread_messages_page()
         else:
-            self.setup_read_messages_result_page()
+            self.setup_read_messages_result_page(read_messages)
 
     def setup_unread_messages_page(self):
         """
@@ -346,11 +460,14 @@ class ChatApp:
             tk.Label(self.root, text=f"{message['sender']}: {message['message']}").pack()
         tk.Button(self.root, text="Back", command=self.setup_account_page).pack()
 
-    def setup_read_messages_result_page(self):
+    def setup_read_messages_result_page(self, messages=None):
         """
         Displays read messages with a delete option. Add a scroll bar to display all messages comfortably. 
 
         Each message is a button that allows deletion upon clicking. 
+
+        Args:
+            messages (list): The read messages if they were already fetched, otherwise they are requested.
         """
         self.clear_window()
         self.root.title("Read Messages")
@@ -366,7 +483,8 @@ class ChatApp:
         message_frame = tk.Frame(canvas)
         canvas.create_window((0, 0), window=message_frame, anchor="n", width=self.root.winfo_width())
         canvas.configure(yscrollcommand=scrollbar.set)
-        messages = self.client.read_messages()
+        if messages is None:
+            messages = self.client.read_messages()
         idx = len(messages) - 1
         for message in messages[::-1]:
             sender = message['sender']
@@ -434,8 +552,11 @@ class ChatApp:
 
     def clear_window(self):
         """
-        Clears all widgets from the current window.
+        Clears all widgets from the current window, and stops following the unread messages count.
         """
+        if self.unread_stream is not None:
+            self.unread_stream.cancel()
+            self.unread_stream = None
         for widget in self.root.winfo_children():
             widget.destroy()
 
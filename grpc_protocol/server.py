@@ -1,53 +1,557 @@
 import grpc
 from concurrent import futures
-import json
+import orjson
 import os
+import hashlib
+import hmac
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb") # use the C protobuf runtime; must be set before importing chat_pb2
 import chat_pb2
 import chat_pb2_grpc
 import configparser
 import threading
+import queue
+import time
+import sys
+import traceback
+import itertools
+from contextlib import contextmanager, ExitStack
+from collections import deque
+from dataclasses import dataclass
 
 USER_DATA_FILE = "accounts.json"
+USER_LOG_FILE = "accounts.log" # append-only log of mutations since the last snapshot
+SNAPSHOT_INTERVAL = 5 # seconds between snapshots of the accounts to USER_DATA_FILE
+FSYNC_EVERY = 64 # number of log records between fsyncs of the log file
+SCRYPT_PARAMS = {'n': 2**14, 'r': 8, 'p': 1, 'dklen': 32} # cost parameters for password hashing
+HASH_CONCURRENCY = 4 # most password hashes run at once, each takes 16 MB of memory with SCRYPT_PARAMS
+MAX_STREAMS = 50 # default number of SubscribeUnread streams open at once, each holds a worker thread while open
+
+@dataclass(slots=True)
+class StoredMessage:
+    """
+    A message stored in an account. Slots keep each message much smaller than a dict with the same fields.
+    
+    Attributes:
+        sender (str): The username of the sender.
+        message (str): The message content.
+        id (int): The id of the message, or 0 if it has not been given one yet.
+        deleted (bool): Whether the message was deleted and is waiting to be compacted.
+    """
+    sender: str
+    message: str
+    id: int = 0
+    deleted: bool = False
+
+    def __post_init__(self):
+        # senders repeat across many messages, so all of them share one string per username
+        self.sender = sys.intern(self.sender)
+
+def to_json(obj):
+    """
+    Converts the objects orjson cannot serialize by itself when saving the accounts.
+    
+    Args:
+        obj: A deque of messages or a StoredMessage.
+    
+    Returns:
+        list or dict: The JSON-serializable form of the object.
+    """
+    if isinstance(obj, deque):
+        return list(obj)
+    return {'id': obj.id, 'sender': obj.sender, 'message': obj.message}
+
+class RWLock:
+    """
+    A reader-writer lock that can be held by many readers or by a single writer.
+    
+    Waiting writers block new readers, so a steady stream of readers cannot starve a writer.
+    """
+    def __init__(self):
+        """
+        Initializes the RWLock instance.
+        """
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """
+        Holds the lock in shared mode.
+        """
+        with self.cond:
+            while self.writing or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """
+        Holds the lock in exclusive mode.
+        """
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
 
 class ChatService(chat_pb2_grpc.ChatServiceServicer):
     """
     Implements the gRPC chat service.
     
     This class provides functionality for user authentication, message handling, and account management.
-    It ensures thread-safe operations using a threading lock.
+    It ensures thread-safe operations using per-user locks, so requests for different users run in parallel.
     """
-    def __init__(self):
+    def __init__(self, max_streams=MAX_STREAMS):
         """
         Initializes the ChatService instance.
         
+        Args:
+            max_streams (int): The most SubscribeUnread streams open at once. It must be below the number of worker 
+                threads, so the other RPCs always have workers left.
+        
         Attributes:
             accounts (dict): A dictionary storing user information loaded from a JSON file.
-            lock (threading.Lock): A lock to ensure thread-safe access to user accounts.
+            lock (RWLock): Held in shared mode by every request and in exclusive mode by account deletion and snapshots.
+            user_locks (dict): A lock per username, held while a request reads or changes that user's account.
+            log_file (file): The append-only log that records every mutation since the last snapshot.
+            pending (int): The number of logged mutations not yet included in a snapshot.
+            generation (int): The number of the latest snapshot, saved with it and at the start of the log that follows it.
+            hash_slots (threading.BoundedSemaphore): Limits how many password hashes run at the same time.
+            unread_subscribers (dict): For each username, the queues of the open SubscribeUnread streams.
+            stream_slots (threading.BoundedSemaphore): Limits how many SubscribeUnread streams are open at the same time.
+            sent_by (dict): For each username, the (recipient, message id) pairs of the messages the user sent.
+            message_ids (itertools.count): The source of ids for new messages.
+            accounts_lower (dict): The lowercased form of every username, used to search accounts.
+            read_index (dict): For each username, the user's read messages by id.
+            tombstones (int): The number of deleted messages waiting to be compacted by the next snapshot.
         """
+        self.lock = RWLock()
+        self.user_locks = {}
+        self.locks_guard = threading.Lock() # guards the creation of user locks
+        self.log_lock = threading.Lock() # serializes writes to the log file
+        self.hash_slots = threading.BoundedSemaphore(HASH_CONCURRENCY)
+        self.unread_subscribers = {}
+        self.subscribers_lock = threading.Lock() # guards unread_subscribers
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+        self.replay = {
+            'create_account': self.create_account,
+            'set_password': self.set_password,
+            'store_message': self.store_message,
+            'mark_read': self.mark_read,
+            'remove_message': self.remove_message,
+            'remove_account': self.remove_account,
+        }
+        self.batch_handlers = {
+            'login': self.Login,
+            'send_message': self.SendMessage,
+            'read_unread_messages': self.ReadUnreadMessages,
+            'read_messages': self.ReadMessages,
+            'get_unread_messages': self.GetUnreadMessages,
+            'list_accounts': self.ListAccounts,
+            'delete_message': self.DeleteMessage,
+            'delete_account': self.DeleteAccount,
+        }
+        self.tombstones = 0
+        self.pending = 0
+        self.directory_lock = threading.Lock() # guards accounts_lower
         self.accounts = self.load_accounts()
-        self.lock = threading.Lock()
+        self.accounts_lower = {username: username.lower() for username in self.accounts}
+        # the indexes are built from the snapshot before replay, since replayed deletions look messages up in them
+        self.index_messages()
+        replayed = self.replay_log()
+        self.pending += replayed
+        self.message_ids = itertools.count(self.max_message_id() + 1)
+        self.log_file = open(USER_LOG_FILE, "ab")
+        if not replayed: # the log is missing, empty or already in the snapshot
+            self.start_log()
+        threading.Thread(target=self.snapshot_loop, daemon=True).start()
 
     def load_accounts(self):
         """
-        Loads user accounts from a JSON file.
+        Loads user accounts from a JSON file, and sets generation to the generation of the snapshot.
+        
+        Messages are kept in deques, so reading the oldest unread messages does not shift the rest.
         
         Returns:
             dict: A dictionary containing user accounts.
         """
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, "r") as file:
-                return json.load(file)
-        return {}
+        self.generation = 0
+        if not os.path.exists(USER_DATA_FILE):
+            return {}
+        with open(USER_DATA_FILE, "rb") as file:
+            accounts = orjson.loads(file.read())
+        if isinstance(accounts.get('generation'), int): # a snapshot saved with its generation, not a bare accounts dict
+            self.generation = accounts['generation']
+            accounts = accounts['accounts']
+        for account in accounts.values():
+            account['unread_messages'] = deque(StoredMessage(**msg) for msg in account['unread_messages'])
+            account['read_messages'] = deque(StoredMessage(**msg) for msg in account['read_messages'])
+        return accounts
+
+    def replay_log(self):
+        """
+        Re-applies the mutations recorded in the log file on top of the loaded snapshot.
+        
+        The log starts with the generation of the snapshot it follows. A log from an older generation is already 
+        included in the snapshot, since a crash stopped the snapshot after saving the accounts and before emptying 
+        the log, so it is not replayed.
+        
+        Every record ends with a newline, so only a last line without one can be torn by a crash. That line is cut
+        off the file. Any other record that cannot be read or applied is an error, and the server does not start.
+        
+        Returns:
+            int: The number of records replayed.
+        """
+        if not os.path.exists(USER_LOG_FILE):
+            return 0
+        with open(USER_LOG_FILE, "rb") as file:
+            data = file.read()
+        lines = data.split(b"\n")
+        records = [orjson.loads(line) for line in lines[:-1]]
+        log_generation = 0 # a log written before logs had a generation
+        if records and 'op' not in records[0]:
+            log_generation = records.pop(0)['generation']
+        if log_generation != self.generation:
+            return 0
+        if lines[-1]: # a record torn by a crash while it was being written
+            os.truncate(USER_LOG_FILE, len(data) - len(lines[-1]))
+        for record in records:
+            self.replay[record['op']](**record['args'])
+        return len(records)
+
+    def start_log(self):
+        """
+        Empties the log file and writes the current generation at its start, so a later replay can tell whether 
+        the records that follow are already included in the snapshot.
+        """
+        with self.log_lock:
+            self.log_file.truncate(0)
+            self.log_file.write(orjson.dumps({'generation': self.generation}, option=orjson.OPT_APPEND_NEWLINE))
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+
+    def index_messages(self):
+        """
+        Builds the indexes of messages by sender and of read messages by id, and gives an id to messages loaded without one.
+        The replayed and later mutations keep the indexes up to date.
+        """
+        self.sent_by = {}
+        self.read_index = {user: {} for user in self.accounts}
+        messages = [(user, msg) for user in self.accounts for box in ('unread_messages', 'read_messages') for msg in self.accounts[user][box]]
+        max_id = max((msg.id for _, msg in messages), default=0)
+        for user, msg in messages:
+            if not msg.id:
+                max_id += 1
+                msg.id = max_id
+                self.pending += 1 # make sure the new ids are saved by the next snapshot
+            self.sent_by.setdefault(msg.sender, []).append((user, msg.id))
+        for user in self.accounts:
+            for msg in self.accounts[user]['read_messages']:
+                if not msg.deleted:
+                    self.read_index[user][msg.id] = msg
+
+    def max_message_id(self):
+        """
+        Finds the largest message id in use.
+        
+        Returns:
+            int: The largest id of a stored message, or 0 if there are no messages.
+        """
+        return max((msg.id for account in self.accounts.values() 
+                    for msg in itertools.chain(account['unread_messages'], account['read_messages'])), default=0)
 
     def save_accounts(self, accounts):
         """
         Saves user accounts to a JSON file.
         
+        The data is written to a temporary file first and then renamed, so a crash never leaves a partial snapshot.
+        The current generation is saved with the accounts.
+        
         Args:
             accounts (dict): The accounts data to save.
         """
-        with open(USER_DATA_FILE, "w") as file:
-            json.dump(accounts, file, indent=4)
+        tmp_file = USER_DATA_FILE + ".tmp"
+        snapshot = {'generation': self.generation, 'accounts': accounts}
+        data = memoryview(orjson.dumps(snapshot, default=to_json, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATACLASS))
+        # the snapshot is already one buffer, so it goes straight to the file descriptor without a buffered writer
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_file, USER_DATA_FILE)
+
+    def append_log(self, op, **args):
+        """
+        Appends a mutation record to the log file. Must be called while holding the locks of the mutated accounts.
+        
+        Args:
+            op (str): The name of the mutation, used to look up its replay function.
+            **args: The arguments of the mutation.
+        """
+        record = orjson.dumps({'op': op, 'args': args}, option=orjson.OPT_APPEND_NEWLINE)
+        with self.log_lock:
+            self.log_file.write(record)
+            self.log_file.flush()
+            self.pending += 1
+            if self.pending % FSYNC_EVERY == 0:
+                os.fsync(self.log_file.fileno())
+
+    def snapshot(self):
+        """
+        Writes the accounts to the JSON file and empties the log if there are pending mutations.
+        Deleted messages are dropped from the read messages first, so snapshots never contain them.
+        """
+        with self.lock.write():
+            if not self.pending:
+                return
+            if self.tombstones:
+                for account in self.accounts.values():
+                    account['read_messages'] = deque(msg for msg in account['read_messages'] if not msg.deleted)
+                self.tombstones = 0
+            self.generation += 1 # the snapshot includes every record logged so far
+            self.save_accounts(self.accounts)
+            self.start_log()
+            self.pending = 0
+
+    def lock_for(self, username):
+        """
+        Returns the lock of a user, creating it on first use.
+        
+        Args:
+            username (str): The username of the account.
+        
+        Returns:
+            threading.Lock: The lock of the user.
+        """
+        lock = self.user_locks.get(username)
+        if lock is None:
+            with self.locks_guard:
+                lock = self.user_locks.setdefault(username, threading.Lock())
+        return lock
+
+    @contextmanager
+    def locked(self, *usernames):
+        """
+        Holds the global lock in shared mode and the locks of the given users.
+        
+        User locks are always taken in sorted order, so two requests can never wait on each other.
+        
+        Args:
+            *usernames (str): The usernames of the accounts the request touches.
+        """
+        with self.lock.read(), ExitStack() as stack:
+            for username in sorted(set(usernames)):
+                stack.enter_context(self.lock_for(username))
+            yield
+
+    def notify_unread(self, username):
+        """
+        Pushes the current unread messages count of a user to the user's subscribers.
+        Must be called while holding the user's lock.
+        
+        Args:
+            username (str): The username of the account.
+        """
+        with self.subscribers_lock:
+            subscribers = self.unread_subscribers.get(username)
+            if not subscribers:
+                return
+            count = len(self.accounts[username]['unread_messages']) if username in self.accounts else None
+            for subscriber in subscribers:
+                subscriber.put(count)
+
+    def snapshot_loop(self):
+        """
+        Periodically snapshots the accounts in a background thread. A failed snapshot, such as one that runs out of
+        disk space, is reported and tried again at the next interval, since its mutations are still pending.
+        """
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.snapshot()
+            except Exception:
+                traceback.print_exc()
+
+    def hash_password(self, password, salt):
+        """
+        Hashes a password with scrypt in the calling RPC thread.
+        
+        hashlib releases the GIL while hashing, so other RPCs keep running in the meantime. The hash slots are only a
+        concurrency limit: a login waits for a free slot, which bounds the memory and CPU taken by a burst of logins.
+        
+        Args:
+            password (str): The password to hash.
+            salt (bytes): The salt of the account.
+        
+        Returns:
+            bytes: The password hash.
+        """
+        with self.hash_slots:
+            return hashlib.scrypt(password.encode('utf-8'), salt=salt, **SCRYPT_PARAMS)
+
+    def check_password(self, account, password):
+        """
+        Checks a password against the one stored in an account.
+        
+        Args:
+            account (dict): The account.
+            password (str): The password sent by the client.
+        
+        Returns:
+            bool: True if the password is correct, False otherwise.
+        """
+        if 'pwhash' not in account: # account stored the SHA-256 digest that clients sent before the server hashed passwords
+            digest = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            return hmac.compare_digest(account['password'].encode('utf-8'), digest.encode('utf-8'))
+        pwhash = self.hash_password(password, bytes.fromhex(account['salt']))
+        return hmac.compare_digest(pwhash.hex(), account['pwhash'])
+
+    def create_account(self, username, salt, pwhash):
+        """
+        Creates a new account with no messages.
+        
+        Args:
+            username (str): The username of the new account.
+            salt (str): The hex-encoded salt of the new account.
+            pwhash (str): The hex-encoded password hash of the new account.
+        """
+        self.accounts[username] = {'salt': salt, 'pwhash': pwhash, 'read_messages': deque(), 'unread_messages': deque()}
+        self.read_index[username] = {}
+        with self.directory_lock:
+            self.accounts_lower[username] = username.lower()
+
+    def set_password(self, username, salt, pwhash):
+        """
+        Replaces the stored password of an account with a salted hash.
+        
+        Args:
+            username (str): The username of the account.
+            salt (str): The hex-encoded salt of the account.
+            pwhash (str): The hex-encoded password hash of the account.
+        """
+        account = self.accounts[username]
+        account.pop('password', None)
+        account['salt'] = salt
+        account['pwhash'] = pwhash
+
+    def store_message(self, msg_id, sender, recipient, message):
+        """
+        Adds a message to the recipient's unread messages.
+        
+        Args:
+            msg_id (int): The id of the message.
+            sender (str): The username of the sender.
+            recipient (str): The username of the recipient.
+            message (str): The message content.
+        
+        Returns:
+            bool: True if the message was stored, False if the recipient does not exist.
+        """
+        account = self.accounts.get(recipient)
+        if account is None:
+            return False
+        account['unread_messages'].append(StoredMessage(sender, message, msg_id))
+        self.sent_by.setdefault(sender, []).append((recipient, msg_id))
+        return True
+
+    def mark_read(self, username, per_page):
+        """
+        Moves the oldest unread messages of a user to the user's read messages.
+        
+        Args:
+            username (str): The username of the account.
+            per_page (int): The number of messages to move.
+        
+        Returns:
+            list: The messages that were moved.
+        """
+        unread = self.accounts[username]['unread_messages']
+        unread_messages = [unread.popleft() for _ in range(min(per_page, len(unread)))]
+        self.accounts[username]['read_messages'].extend(unread_messages)
+        self.read_index[username].update((msg.id, msg) for msg in unread_messages)
+        return unread_messages
+
+    def find_read_message(self, username, idx):
+        """
+        Finds the id of a read message from its position among the user's messages that are not deleted.
+        
+        Args:
+            username (str): The username of the account.
+            idx (int): The index of the message, as listed by ReadMessages.
+        
+        Returns:
+            int: The id of the message, or 0 if there is no such message.
+        """
+        live_messages = (msg for msg in self.accounts[username]['read_messages'] if not msg.deleted)
+        msg = next(itertools.islice(live_messages, idx, None), None)
+        return msg.id if msg is not None else 0
+
+    def remove_message(self, username, msg_id):
+        """
+        Deletes a read message of a user by marking it as deleted. The message is dropped by the next snapshot.
+        
+        Args:
+            username (str): The username of the account.
+            msg_id (int): The id of the message.
+        """
+        msg = self.read_index[username].pop(msg_id)
+        msg.deleted = True
+        self.tombstones += 1
+
+    def remove_account(self, username):
+        """
+        Deletes an account and all messages sent from it.
+        
+        Args:
+            username (str): The username of the account to delete.
+        """
+        # only the recipients of this user's messages need to be filtered
+        sent_ids = {}
+        for recipient, msg_id in self.sent_by.pop(username, []):
+            sent_ids.setdefault(recipient, set()).add(msg_id)
+        for recipient, msg_ids in sent_ids.items():
+            account = self.accounts.get(recipient)
+            if account is None:
+                continue
+            account['unread_messages'] = deque(msg for msg in account['unread_messages'] if msg.id not in msg_ids)
+            account['read_messages'] = deque(msg for msg in account['read_messages'] if msg.id not in msg_ids)
+            for msg_id in msg_ids:
+                self.read_index[recipient].pop(msg_id, None)
+        del self.accounts[username]
+        del self.read_index[username]
+        with self.directory_lock:
+            del self.accounts_lower[username]
+
+    def add_messages(self, field, messages):
+        """
+        Appends stored messages to a repeated Message field of a response, without building an intermediate list.
+        
+        Args:
+            field (RepeatedCompositeFieldContainer): The repeated field to fill.
+            messages (iterable): The stored messages.
+        """
+        for msg in messages:
+            if not msg.deleted:
+                field.add(sender=msg.sender, message=msg.message, id=msg.id)
 
     def Login(self, request, context):
         """
@@ -62,15 +566,24 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         """
         username = request.username
         password = request.password
-        if username in self.accounts:
-            if self.accounts[username]['password'] == password:
-                return chat_pb2.LoginResponse(success=True, message="Login successful.")
+        with self.locked(username):
+            account = self.accounts.get(username)
+            if account is not None:
+                if self.check_password(account, password):
+                    if 'pwhash' not in account: # move a legacy account to scrypt now that we know its password
+                        salt = os.urandom(16)
+                        pwhash = self.hash_password(password, salt).hex()
+                        self.set_password(username, salt.hex(), pwhash)
+                        self.append_log('set_password', username=username, salt=salt.hex(), pwhash=pwhash)
+                    return chat_pb2.LoginResponse(success=True, message="Login successful.")
+                else:
+                    return chat_pb2.LoginResponse(success=False, message="Incorrect password.")
             else:
-                return chat_pb2.LoginResponse(success=False, message="Incorrect password.")
-        else:
-            self.accounts[username] = {'password': password, 'read_messages': [], 'unread_messages': []}
-            self.save_accounts(self.accounts)
-            return chat_pb2.LoginResponse(success=True, message="Account created and login successful.")
+                salt = os.urandom(16)
+                pwhash = self.hash_password(password, salt).hex()
+                self.create_account(username, salt.hex(), pwhash)
+                self.append_log('create_account', username=username, salt=salt.hex(), pwhash=pwhash)
+                return chat_pb2.LoginResponse(success=True, message="Account created and login successful.")
 
     def SendMessage(self, request, context):
         """
@@ -84,12 +597,14 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             chat_pb2.MessageResponse: A response indicating whether sending messages was successful or not.
         """
         recipient = request.recipient
-        if recipient in self.accounts:
-            self.accounts[recipient]['unread_messages'].append({"sender": request.sender, "message": request.message})
-            self.save_accounts(self.accounts)
-            return chat_pb2.SendMessageResponse(success=True, message="Message sent successfully.")
-        else:
-            return chat_pb2.SendMessageResponse(success=False, message="Invalid recipient.")
+        with self.locked(request.sender, recipient):
+            msg_id = next(self.message_ids)
+            if self.store_message(msg_id, request.sender, recipient, request.message):
+                self.append_log('store_message', msg_id=msg_id, sender=request.sender, recipient=recipient, message=request.message)
+                self.notify_unread(recipient)
+                return chat_pb2.SendMessageResponse(success=True, message="Message sent successfully.")
+            else:
+                return chat_pb2.SendMessageResponse(success=False, message="Invalid recipient.")
 
     def ReadUnreadMessages(self, request, context):
         """
@@ -104,11 +619,14 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         """
         username = request.username
         per_page = request.per_page
-        unread_messages = self.accounts[username]['unread_messages'][:per_page]
-        self.accounts[username]['read_messages'].extend(unread_messages)
-        self.accounts[username]['unread_messages'] = self.accounts[username]['unread_messages'][per_page:]
-        self.save_accounts(self.accounts)
-        return chat_pb2.ReadUnreadMessagesResponse(messages=[chat_pb2.Message(sender=msg['sender'], message=msg['message']) for msg in unread_messages])
+        with self.locked(username):
+            unread_messages = self.mark_read(username, per_page)
+            self.append_log('mark_read', username=username, per_page=per_page)
+            self.notify_unread(username)
+        response = chat_pb2.ReadUnreadMessagesResponse()
+        self.add_messages(response.messages, unread_messages)
+        context.set_compression(grpc.Compression.Gzip) # message lists are plain text and compress well
+        return response
 
     def ReadMessages(self, request, context):
         """
@@ -122,8 +640,11 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             chat_pb2.ReadMessagesResponse: A response containing the all read messages for the user.
         """
         username = request.username
-        messages = self.accounts[username]['read_messages']
-        return chat_pb2.ReadMessagesResponse(messages=[chat_pb2.Message(sender=msg['sender'], message=msg['message']) for msg in messages])
+        response = chat_pb2.ReadMessagesResponse()
+        with self.locked(username):
+            self.add_messages(response.messages, self.accounts[username]['read_messages'])
+        context.set_compression(grpc.Compression.Gzip)
+        return response
 
     def GetUnreadMessages(self, request, context):
         """
@@ -137,8 +658,11 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             chat_pb2.GetUnreadMessagesResponse: A response containing the all unread messages for the user.
         """
         username = request.username
-        unread_messages = self.accounts[username]['unread_messages']
-        return chat_pb2.GetUnreadMessagesResponse(unread_messages=[chat_pb2.Message(sender=msg['sender'], message=msg['message']) for msg in unread_messages])
+        response = chat_pb2.GetUnreadMessagesResponse()
+        with self.locked(username):
+            self.add_messages(response.unread_messages, self.accounts[username]['unread_messages'])
+        context.set_compression(grpc.Compression.Gzip)
+        return response
 
     def ListAccounts(self, request, context):
         """
@@ -152,8 +676,8 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             chat_pb2.ListAccountsResponse: A response containing the list of matching accounts.
         """
         query = request.query.lower()
-        accounts = list(self.accounts.keys())
-        searched_accounts = [acc for acc in accounts if query in acc.lower()]
+        with self.directory_lock:
+            searched_accounts = [acc for acc, acc_lower in self.accounts_lower.items() if query in acc_lower]
         return chat_pb2.ListAccountsResponse(list_accounts=searched_accounts)
 
     def DeleteMessage(self, request, context):
@@ -161,16 +685,20 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
         Handles requests to delete a specific message from a user's account.
         
         Args:
-            request (chat_pb2.DeleteMessageRequest): The request containing the username, sender, message, and index of the message to delete.
+            request (chat_pb2.DeleteMessageRequest): The request containing the username, sender, message, and the id of the 
+                message to delete, or its index if the id is not set.
             context (grpc.ServicerContext): The gRPC context for the request.
         
         Returns:
             chat_pb2.DeleteMessageResponse: A response indicating whether the message was successfully deleted.
         """
         username = request.username
-        idx = request.idx
-        del self.accounts[username]["read_messages"][idx]
-        self.save_accounts(self.accounts)
+        with self.locked(username):
+            msg_id = request.id or self.find_read_message(username, request.idx)
+            if msg_id not in self.read_index[username]:
+                return chat_pb2.DeleteMessageResponse(success=False, message="Message not found.")
+            self.remove_message(username, msg_id)
+            self.append_log('remove_message', username=username, msg_id=msg_id)
         return chat_pb2.DeleteMessageResponse(success=True, message="Message deleted successfully.")
 
     def DeleteAccount(self, request, context):
@@ -185,21 +713,99 @@ class ChatService(chat_pb2_grpc.ChatServiceServicer):
             chat_pb2.DeleteAccountResponse: A response indicating whether the account was successfully deleted.
         """
         username = request.username
-        for user in self.accounts:
-            self.accounts[user]['unread_messages'] = [msg for msg in self.accounts[user]['unread_messages'] if msg['sender'] != username]
-            self.accounts[user]['read_messages'] = [msg for msg in self.accounts[user]['read_messages'] if msg['sender'] != username]
-        del self.accounts[username]
-        self.save_accounts(self.accounts)
+        with self.lock.write():
+            self.remove_account(username)
+            self.append_log('remove_account', username=username)
+            self.user_locks.pop(username, None)
+            for user in list(self.unread_subscribers):
+                self.notify_unread(user) # the deleted account's own streams get None and end
         return chat_pb2.DeleteAccountResponse(success=True, message="Account deleted successfully.")
 
+    def SubscribeUnread(self, request, context):
+        """
+        Handles requests to follow the unread messages count of a user.
+        
+        The current count is sent right away, and a new count is pushed whenever it changes,
+        until the client cancels the stream or the account is deleted.
+        
+        A stream holds a worker thread for as long as it is open, so once max_streams streams are open a new one
+        is refused with RESOURCE_EXHAUSTED, and the client polls GetUnreadMessages instead.
+        
+        Args:
+            request (chat_pb2.SubscribeUnreadRequest): The request containing the username.
+            context (grpc.ServicerContext): The gRPC context for the request.
+        
+        Yields:
+            chat_pb2.UnreadCount: The unread messages count of the user.
+        """
+        if not self.stream_slots.acquire(blocking=False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many open streams.")
+        username = request.username
+        subscriber = queue.Queue()
+        context.add_callback(lambda: subscriber.put(None)) # wake up the stream when the client goes away
+        try:
+            with self.locked(username):
+                with self.subscribers_lock:
+                    self.unread_subscribers.setdefault(username, []).append(subscriber)
+                count = len(self.accounts[username]['unread_messages']) if username in self.accounts else None
+            try:
+                while count is not None:
+                    yield chat_pb2.UnreadCount(count=count)
+                    count = subscriber.get()
+            finally:
+                with self.subscribers_lock:
+                    self.unread_subscribers[username].remove(subscriber)
+                    if not self.unread_subscribers[username]:
+                        del self.unread_subscribers[username]
+        finally:
+            self.stream_slots.release()
+
+    def Batch(self, request, context):
+        """
+        Handles several requests sent in a single call, so a client pays for one round trip instead of one per request.
+        
+        The requests are handled in order, each exactly as if it had been sent on its own.
+        
+        Args:
+            request (chat_pb2.BatchRequest): The request containing the list of requests.
+            context (grpc.ServicerContext): The gRPC context for the request.
+        
+        Returns:
+            chat_pb2.BatchResponse: A response containing the response to each request, in the same order.
+        """
+        response = chat_pb2.BatchResponse()
+        for sub_request in request.requests:
+            kind = sub_request.WhichOneof('request')
+            if kind is None:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Batch request without a request set.")
+            sub_response = self.batch_handlers[kind](getattr(sub_request, kind), context)
+            getattr(response.responses.add(), kind).CopyFrom(sub_response)
+        return response
+
+def serve(host, port, workers):
+    """
+    Starts the gRPC server and blocks until it terminates.
+    
+    Accounts live in the memory of this process, so the port is bound without SO_REUSEPORT: 
+    a second server started on the same port fails instead of silently taking half of the clients.
+    
+    Args:
+        host (str): The IP address to bind the server to.
+        port (int): The port to listen on.
+        workers (int): The number of worker threads. A logged-in client holds one for its SubscribeUnread stream, 
+            so streams may take at most half of them.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers), options=[('grpc.so_reuseport', 0)])
+    chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(max_streams=max(1, workers // 2)), server)
+    server.add_insecure_port(f'{host}:{port}')
+    print(f"Server started at {host}:{port}")
+    server.start()
+    server.wait_for_termination()
+
 if __name__ == '__main__':
     config = configparser.ConfigParser()
     config.read('config.ini')
     host = config['server']['host']
     port = int(config['server']['port'])
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatService(), server)
-    server.add_insecure_port(f'{host}:{port}')
-    print(f"Server started at {host}:{port}")
-    server.start()
-    server.wait_for_termination()
\ No newline at end of file
+    workers = config['server'].getint('workers', 100)
+    serve(host, port, workers)
\ No newline at end of file
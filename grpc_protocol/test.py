@@ -1,6 +1,12 @@
 import unittest
 import threading
 import time
+import os
+import hashlib
+import tempfile
+from unittest import mock
+from contextlib import contextmanager
+from collections import deque
 import grpc
 from concurrent import futures
 import client
@@ -14,23 +20,27 @@ class TestClientServer(unittest.TestCase):
     def setUpClass(cls):
         """Start the gRPC server in a separate thread before running any tests."""
         cls.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-        chat_pb2_grpc.add_ChatServiceServicer_to_server(server.ChatService(), cls.server)
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(server.ChatService(max_streams=5), cls.server)
         cls.server.add_insecure_port('[::]:5555')  # Use the gRPC port
         cls.server_thread = threading.Thread(target=cls.server.start)
         cls.server_thread.daemon = True  # Daemonize thread to exit when the main program exits
         cls.server_thread.start()
 
-        # Wait for the server to start
-        time.sleep(1)  
+        # The channels are opened once and shared by the clients of all tests; wait until they are ready
+        cls.channels = client.Client().channels
+        for channel in cls.channels:
+            grpc.channel_ready_future(channel).result(timeout=5)
 
     @classmethod
     def tearDownClass(cls):
         """Clean up after all tests are done."""
+        for channel in cls.channels:
+            channel.close()
         cls.server.stop(0) 
 
     def setUp(self):
-        """Initialize the gRPC client for each test."""
-        self.client = client.Client() 
+        """Initialize a gRPC client on the shared channels for each test."""
+        self.client = client.Client(channels=self.channels)
 
     def test_server_creation(self):
         """Test that the server is created correctly."""
@@ -40,6 +50,8 @@ class TestClientServer(unittest.TestCase):
         """Test that the client is created correctly."""
         test_client = client.Client()
         self.assertIsInstance(test_client, client.Client)
+        for channel in test_client.channels: # this client opened its own channels
+            channel.close()
 
     def test_login_existing_user(self):
         """Test logging in with an existing user."""
@@ -152,6 +164,86 @@ class TestClientServer(unittest.TestCase):
         self.assertEqual(result, [{'sender': 'sender', 'message': 'Hello'}])
 
 
+    def test_subscribe_unread(self):
+        """Test that the unread messages count is pushed via gRPC when it changes."""
+        self.client.login('subscriber', '123')
+        self.client.login('sender', '123')
+
+        self.client.username = 'subscriber'
+        stream = self.client.subscribe_unread()
+        count = next(stream).count
+
+        self.client.username = 'sender'
+        status, _ = self.client.send_message('subscriber', 'Hello')
+        self.assertTrue(status, "Message sending failed, so the count does not change!")
+
+        # Verify the new count was pushed
+        self.assertEqual(next(stream).count, count + 1)
+        stream.cancel()
+
+    def test_subscribe_unread_limit(self):
+        """Test that streams beyond the limit are refused, so the other RPCs still have workers."""
+        self.client.login('limit_subscriber', '123')
+        self.client.username = 'limit_subscriber'
+        streams = [self.client.subscribe_unread() for _ in range(5)]
+        try:
+            for stream in streams:
+                next(stream) # the stream is open once its first count arrives
+            refused = self.client.subscribe_unread()
+            with self.assertRaises(grpc.RpcError) as error:
+                next(refused)
+            self.assertEqual(error.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+            self.assertEqual(self.client.get_unread(), []) # answered while every stream slot is taken
+        finally:
+            for stream in streams:
+                stream.cancel()
+
+
+    def test_batch(self):
+        """Test sending several requests in one gRPC call."""
+        self.client.login('batch_user', '123')
+        self.client.login('sender', '123')
+
+        responses = self.client.batch([
+            chat_pb2.SendMessageRequest(sender='sender', recipient='batch_user', message='Hello'),
+            chat_pb2.SendMessageRequest(sender='sender', recipient='invalid_recipient', message='Hello'),
+            chat_pb2.ListAccountsRequest(query='batch_user'),
+        ])
+
+        # Verify each request got its own response, in order
+        self.assertTrue(responses[0].success)
+        self.assertFalse(responses[1].success)
+        self.assertEqual(list(responses[2].list_accounts), ['batch_user'])
+
+    def test_batch_without_request(self):
+        """Test that a batch entry with no request set is rejected as an invalid argument."""
+        batch_request = chat_pb2.BatchRequest()
+        batch_request.requests.add()
+        with self.assertRaises(grpc.RpcError) as error:
+            self.client.stub.Batch(batch_request)
+        self.assertEqual(error.exception.code(), grpc.StatusCode.INVALID_ARGUMENT)
+
+    def test_check_messages(self):
+        """Test getting the unread and the read messages in one call."""
+        self.client.login('checker', '123')
+        self.client.login('sender', '123')
+
+        self.client.username = 'checker'
+        self.client.read_unread_messages(1000) # the accounts are kept between runs, so start with nothing unread
+        self.client.username = 'sender'
+        self.client.send_message('checker', 'Read')
+        self.client.username = 'checker'
+        self.client.read_unread_messages(1)
+        self.client.username = 'sender'
+        self.client.send_message('checker', 'Unread')
+
+        self.client.username = 'checker'
+        unread_messages, read_messages = self.client.check_messages()
+        self.assertEqual(unread_messages, [{'sender': 'sender', 'message': 'Unread'}])
+        self.assertEqual(read_messages[-1], {'sender': 'sender', 'message': 'Read'})
+        self.assertEqual(len(self.client.read_message_ids), len(read_messages)) # read messages can be deleted by index
+
+
     def test_delete_message(self):
         """Test deleting a message via gRPC."""
         self.client.login('user', '123')
@@ -169,6 +261,27 @@ class TestClientServer(unittest.TestCase):
         self.assertEqual(result, 'Message deleted successfully.')
 
 
+    def test_delete_message_hides_it(self):
+        """Test that a deleted message is no longer returned via gRPC."""
+        self.client.login('deleting_user', '123')
+        self.client.login('sender', '123')
+
+        self.client.username = 'sender'
+        self.client.send_message('deleting_user', 'Keep')
+        self.client.send_message('deleting_user', 'Delete')
+
+        self.client.username = 'deleting_user'
+        self.client.read_unread_messages(2)
+        messages = self.client.read_messages()
+        idx = messages.index({'sender': 'sender', 'message': 'Delete'})
+
+        # Delete message and check the read messages
+        self.client.delete_message('sender', 'Delete', idx)
+        messages = self.client.read_messages()
+        self.assertNotIn({'sender': 'sender', 'message': 'Delete'}, messages)
+        self.assertIn({'sender': 'sender', 'message': 'Keep'}, messages)
+
+
     def test_delete_account(self):
         """Test deleting an account via gRPC."""
         self.client.login('user', '123')  
@@ -186,5 +299,119 @@ class TestClientServer(unittest.TestCase):
 
 
 
+    def test_delete_account_removes_sent_messages(self):
+        """Test that deleting an account removes the messages it sent via gRPC."""
+        self.client.login('leaving_user', '123')
+        self.client.login('staying_user', '123')
+
+        self.client.username = 'leaving_user'
+        status, _ = self.client.send_message('staying_user', 'Hello')
+        self.assertTrue(status, "Message sending failed, so there's nothing to remove!")
+        self.client.delete_account()
+
+        # Verify the message is gone from the recipient's unread messages
+        self.client.username = 'staying_user'
+        senders = [msg['sender'] for msg in self.client.get_unread()]
+        self.assertNotIn('leaving_user', senders)
+
+
+    @contextmanager
+    def data_files(self):
+        """Point the services created inside the block at their own snapshot and log files."""
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.object(server, 'USER_DATA_FILE', os.path.join(tmp, 'accounts.json')), \
+             mock.patch.object(server, 'USER_LOG_FILE', os.path.join(tmp, 'accounts.log')):
+            yield
+
+    def stop_services(self, *services):
+        """Close the log files of services created inside data_files."""
+        for service in services:
+            service.pending = 0 # leave nothing for their snapshot threads to write once the files are unpatched
+            service.log_file.close()
+
+    def test_snapshot_retried_after_failure(self):
+        """Test that the snapshot thread reports a failed snapshot and keeps snapshotting."""
+        context = mock.Mock()
+        with self.data_files(), mock.patch.object(server, 'SNAPSHOT_INTERVAL', 0.01), \
+             mock.patch.object(server.traceback, 'print_exc') as print_exc:
+            service = server.ChatService()
+            save_accounts = service.save_accounts
+            failures = [OSError(28, 'No space left on device')]
+            def save_once_full(accounts):
+                if failures:
+                    raise failures.pop()
+                save_accounts(accounts)
+            service.save_accounts = save_once_full
+            service.Login(chat_pb2.LoginRequest(username='user', password='123'), context)
+            deadline = time.monotonic() + 5
+            while service.pending and time.monotonic() < deadline:
+                time.sleep(0.01)
+            pending = service.pending
+            self.stop_services(service)
+
+        print_exc.assert_called_once()
+        self.assertEqual(pending, 0)
+
+    def test_login_legacy_account(self):
+        """Test logging in to an account stored before passwords were hashed by the server."""
+        context = mock.Mock()
+        with self.data_files():
+            service = server.ChatService()
+            digest = hashlib.sha256('pw'.encode('utf-8')).hexdigest() # what the old client sent and the server stored
+            service.accounts['legacy_user'] = {'password': digest, 'read_messages': deque(), 'unread_messages': deque()}
+            service.read_index['legacy_user'] = {}
+            wrong = service.Login(chat_pb2.LoginRequest(username='legacy_user', password='wrong_password'), context)
+            correct = service.Login(chat_pb2.LoginRequest(username='legacy_user', password='pw'), context)
+            account = dict(service.accounts['legacy_user'])
+            again = service.Login(chat_pb2.LoginRequest(username='legacy_user', password='pw'), context)
+            self.stop_services(service)
+
+        self.assertFalse(wrong.success)
+        self.assertTrue(correct.success)
+        self.assertNotIn('password', account) # rehashed with scrypt on the first successful login
+        self.assertIn('pwhash', account)
+        self.assertTrue(again.success)
+
+    def test_restart_keeps_deletions(self):
+        """Test that deleted messages and accounts stay deleted when a restarted server replays its log."""
+        context = mock.Mock()
+        with self.data_files():
+            service = server.ChatService()
+            service.Login(chat_pb2.LoginRequest(username='reader', password='123'), context)
+            service.Login(chat_pb2.LoginRequest(username='leaver', password='123'), context)
+            for message in ('Keep', 'Delete'):
+                service.SendMessage(chat_pb2.SendMessageRequest(sender='reader', recipient='reader', message=message), context)
+            service.SendMessage(chat_pb2.SendMessageRequest(sender='leaver', recipient='reader', message='Bye'), context)
+            service.ReadUnreadMessages(chat_pb2.ReadUnreadMessagesRequest(username='reader', per_page=3), context)
+            service.snapshot() # the messages are in the snapshot, only the deletions are in the log
+            service.DeleteMessage(chat_pb2.DeleteMessageRequest(username='reader', idx=1), context)
+            service.DeleteAccount(chat_pb2.DeleteAccountRequest(username='leaver'), context)
+
+            # a new service loads the snapshot and replays the deletions on top of it
+            restarted = server.ChatService()
+            accounts = restarted.ListAccounts(chat_pb2.ListAccountsRequest(query=''), context).list_accounts
+            messages = restarted.ReadMessages(chat_pb2.ReadMessagesRequest(username='reader'), context).messages
+            self.stop_services(service, restarted)
+
+        self.assertEqual(list(accounts), ['reader'])
+        self.assertEqual([msg.message for msg in messages], ['Keep'])
+
+    def test_restart_after_interrupted_snapshot(self):
+        """Test that a log already included in the snapshot is not replayed again."""
+        context = mock.Mock()
+        with self.data_files():
+            service = server.ChatService()
+            service.Login(chat_pb2.LoginRequest(username='recipient', password='123'), context)
+            service.SendMessage(chat_pb2.SendMessageRequest(sender='recipient', recipient='recipient', message='Once'), context)
+            # crash after the snapshot is saved but before the log is emptied
+            service.generation += 1
+            service.save_accounts(service.accounts)
+
+            restarted = server.ChatService()
+            messages = restarted.GetUnreadMessages(chat_pb2.GetUnreadMessagesRequest(username='recipient'), context).unread_messages
+            self.stop_services(service, restarted)
+
+        self.assertEqual([msg.message for msg in messages], ['Once'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -8,6 +8,8 @@ class Client:
     """
     A client for a chat application, handling communication with the server.
     """
+    HEADER = 4 # size of the big-endian length prefix in front of every message
+
     def __init__(self, host='127.0.0.1', port=5555):
         """
         Initializes the Client instance and establishes a connection to the server.
@@ -22,6 +24,41 @@ class Client:
         self.client.connect((self.host, self.port))
         self.username = None
 
+    def recv_exact(self, size):
+        """
+        Receives exactly the given number of bytes from the server.
+        
+        Args:
+            size (int): The number of bytes to receive.
+        
+        Returns:
+            bytearray: The received bytes, or None if the connection was closed.
+        """
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = self.client.recv_into(view[received:])
+            if not n:
+                return None
+            received += n
+        return buffer
+
+    def send_recv(self, data):
+        """
+        Sends a length-prefixed JSON request to the server and receives its response.
+        
+        Args:
+            data (dict): The request to be sent.
+        
+        Returns:
+            dict: The decoded response from the server.
+        """
+        payload = json.dumps(data).encode('utf-8')
+        self.client.sendall(len(payload).to_bytes(self.HEADER, 'big') + payload)
+        header = self.recv_exact(self.HEADER)
+        return json.loads(self.recv_exact(int.from_bytes(header, 'big')))
+
     def send_message(self, recipient, message):
         """
         Sends a send message request to server and get response.
@@ -39,8 +76,7 @@ class Client:
             'recipient': recipient,
             'message': message
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return True, response['message']
         else:
@@ -61,8 +97,7 @@ class Client:
             'username': self.username,
             'per_page': per_page
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return response['messages']
         else:
@@ -80,8 +115,7 @@ class Client:
             'action': 'read_all',
             'username': self.username
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return response['messages']
         else:
@@ -99,8 +133,7 @@ class Client:
             'action': 'count_unread',
             'username': self.username
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return response['unread_messages']
         else:
@@ -124,8 +157,7 @@ class Client:
             'username': username,
             'password': password
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             self.username = username
             return True
@@ -147,8 +179,7 @@ class Client:
             'username': self.username,
             'query': query
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return response['list_accounts']
         else:
@@ -173,8 +204,7 @@ class Client:
             'message': message,
             'idx': idx
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return 'Delete message successfully.'
         else:
@@ -191,8 +221,7 @@ class Client:
             'action': 'delete_account',
             'username': self.username,
         }
-        self.client.send(json.dumps(data).encode('utf-8'))
-        response = json.loads(self.client.recv(1024).decode('utf-8'))
+        response = self.send_recv(data)
         if response['status'] == 'success':
             return 'Delete account successfully.'
         else:
@@ -1,166 +1,788 @@
 import socket
+import selectors
 import threading
-import json
+import orjson
 import os
+import hashlib
+import hmac
+import time
+import mmap
+import itertools
+import traceback
+from collections import deque
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor
 
 USER_DATA_FILE = "accounts.json"
+USER_LOG_FILE = "accounts.log" # append-only log of mutations since the last snapshot
+SNAPSHOT_INTERVAL = 5 # seconds between snapshots of the accounts to USER_DATA_FILE
+FSYNC_INTERVAL_MS = 20 # default milliseconds of log records that are flushed and fsynced together
+SOCKET_BUFFER_SIZE = 1 << 20 # kernel send and receive buffer size of each client socket
+RECV_BUFFER_SIZE = 65536 # initial size of the buffer each connection receives requests into
+PASSWORD_DIGEST_SIZE = 8 # bytes of the blake2b digest stored for each password
+MAX_WORKERS = max(32, (os.cpu_count() or 1) * 4) # number of requests handled at the same time
+
+
+def trigrams(text):
+    """
+    Gets the 3-character substrings of a text.
+    
+    Args:
+        text (str): The text.
+    
+    Returns:
+        set: The trigrams of the text.
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class RWLock:
+    """
+    A reader-writer lock that can be held by many readers or by a single writer.
+    
+    Waiting writers block new readers, so a steady stream of readers cannot starve a writer.
+    """
+    def __init__(self):
+        """
+        Initializes the RWLock instance.
+        """
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """
+        Holds the lock in shared mode.
+        """
+        with self.cond:
+            while self.writing or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """
+        Holds the lock in exclusive mode.
+        """
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+
+class Connection:
+    """
+    The state of a client connection served by the event loop.
+    """
+    def __init__(self, client):
+        """
+        Initializes the connection.
+        
+        Args:
+            client (socket): The client socket.
+        """
+        self.client = client
+        self.buffer = bytearray(RECV_BUFFER_SIZE) # reused for every request of this connection
+        self.start = self.end = 0 # the unread bytes are buffer[start:end]
+        self.requests = deque() # complete requests not handled yet, in the order they arrived
+        self.lock = threading.Lock() # guards requests, busy and closed
+        self.busy = False # set while a worker handles the requests, so replies keep their order
+        self.closed = False # set once the client closed the connection
 
 
 class Server:
     """
     A multi-client chat server using a custom wire protocol over sockets.
     """
-    def __init__(self, host='0.0.0.0', port=5555):
+    HEADER = 4 # size of the big-endian length prefix in front of every message
+
+    def __init__(self, host='0.0.0.0', port=5555, fsync_interval_ms=FSYNC_INTERVAL_MS):
         """
         Initializes the server.
         
         Args:
             host (str): The IP address to bind the server to.
             port (int): The port to listen on.
+            fsync_interval_ms (int): How long log records are collected before they are flushed and fsynced together.
         """
         self.host = host
         self.port = port
+        self.fsync_interval = fsync_interval_ms / 1000
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.bind((self.host, self.port))
         self.server.listen()
-        self.accounts = self.load_accounts()
-        self.lock = threading.Lock()
+        # every request holds the global lock in shared mode plus the locks of the users it touches,
+        # so requests for different users run in parallel; account deletion and snapshots hold it exclusively
+        self.lock = RWLock()
+        self.user_locks = {}
+        self.locks_guard = threading.Lock() # guards the creation of user locks
+        self.log_lock = threading.Lock() # serializes writes to the log file
+        self.directory_lock = threading.Lock() # guards accounts_lower and trigram_index
+        self.replay = {
+            'create_account': self.create_account,
+            'store_message': self.store_message,
+            'mark_read': self.mark_read,
+            'remove_message': self.remove_message,
+            'remove_account': self.remove_account,
+        }
+        self.handlers = {
+            'login': self.handle_login,
+            'send': self.handle_send,
+            'read_unread': self.handle_read_unread,
+            'read_all': self.handle_read_all,
+            'count_unread': self.handle_count_unread,
+            'list': self.handle_list,
+            'delete_message': self.handle_delete_message,
+            'delete_account': self.handle_delete_account,
+        }
+        self.accounts = self.load_accounts() # also builds the sent_by index and sets generation
+        self.pending = self.replay_log() # number of logged mutations not yet included in a snapshot
+        self.log_file = open(USER_LOG_FILE, "ab")
+        if not self.pending: # the log is missing, empty or already in the snapshot
+            self.start_log()
+        self.log_dirty = threading.Event() # set when the log has records that are not flushed yet
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+        threading.Thread(target=self.snapshot_loop, daemon=True).start()
+        # one thread waits on every connection and hands complete requests to a fixed set of workers,
+        # so idle connections do not hold a worker
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="chat")
     
+    @property
+    def accounts(self):
+        """
+        dict: The user accounts, keyed by username.
+        """
+        return self.account_data
+
+    @accounts.setter
+    def accounts(self, accounts):
+        for account in accounts.values():
+            account['unread_messages'] = deque(account['unread_messages']) # read in order with popleft
+        self.account_data = accounts
+        self.index_messages()
+        with self.directory_lock:
+            # the lowercased form of every username, used to search accounts
+            self.accounts_lower = {username: username.lower() for username in accounts}
+            # the usernames containing each trigram, used to find candidates for queries of 3 or more characters
+            self.trigram_index = {}
+            for username, username_lower in self.accounts_lower.items():
+                for trigram in trigrams(username_lower):
+                    self.trigram_index.setdefault(trigram, set()).add(username)
+
+    def index_messages(self):
+        """
+        Builds the sent_by index, which maps each sender to the messages they sent, so that deleting an
+        account only visits the recipients of its messages. Messages are keyed by object identity, since
+        the same message object moves from the unread to the read messages of its recipient.
+        """
+        self.sent_by = {}
+        for user, account in self.account_data.items():
+            for msg in itertools.chain(account['unread_messages'], account['read_messages']):
+                self.sent_by.setdefault(msg['from'], {})[id(msg)] = (user, msg)
+
     # Load accounts from JSON
     def load_accounts(self):
         """
-        Loads user accounts from a JSON file.
+        Loads user accounts from a JSON file, and sets generation to the generation of the snapshot.
         
         Returns:
             dict: A dictionary containing user accounts.
         """
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, "r") as file:
-                return json.load(file)
-        return {}
+        self.generation = 0 # number of the latest snapshot, saved with it and at the start of the log that follows it
+        if not (os.path.exists(USER_DATA_FILE) and os.path.getsize(USER_DATA_FILE)):
+            return {}
+        # parse the mapped file directly instead of reading a copy of it into memory first
+        with open(USER_DATA_FILE, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                accounts = orjson.loads(view)
+        if isinstance(accounts.get('generation'), int): # a snapshot saved with its generation, not a bare accounts dict
+            self.generation = accounts['generation']
+            accounts = accounts['accounts']
+        return accounts
+
+    def replay_log(self):
+        """
+        Re-applies the mutations recorded in the log file on top of the loaded snapshot.
+        
+        The log starts with the generation of the snapshot it follows. A log from an older generation is already 
+        included in the snapshot, since a crash stopped the snapshot after saving the accounts and before emptying 
+        the log, so it is not replayed.
+        
+        Every record ends with a newline, so only a last line without one can be torn by a crash. That line is cut
+        off the file before it is opened for appending, so the next record does not run into it. Any other record 
+        that cannot be read or applied is an error, and the server does not start.
+        
+        Returns:
+            int: The number of records replayed.
+        """
+        if not os.path.exists(USER_LOG_FILE):
+            return 0
+        with open(USER_LOG_FILE, "rb") as file:
+            data = file.read()
+        lines = data.split(b"\n")
+        records = [orjson.loads(line) for line in lines[:-1]]
+        log_generation = 0 # a log written before logs had a generation
+        if records and 'op' not in records[0]:
+            log_generation = records.pop(0)['generation']
+        if log_generation != self.generation:
+            return 0
+        if lines[-1]: # a record torn by a crash while it was being written
+            os.truncate(USER_LOG_FILE, len(data) - len(lines[-1]))
+        for record in records:
+            self.replay[record['op']](**record['args'])
+        return len(records)
+
+    def start_log(self):
+        """
+        Empties the log file and writes the current generation at its start, so a later replay can tell whether 
+        the records that follow are already included in the snapshot.
+        """
+        with self.log_lock:
+            self.log_file.truncate(0)
+            self.log_file.write(orjson.dumps({'generation': self.generation}, option=orjson.OPT_APPEND_NEWLINE))
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
 
     # Save accounts to JSON
     def save_accounts(self, accounts):
         """
         Saves user accounts to a JSON file.
         
+        The data is written to a temporary file first and then renamed, so a crash never leaves a partial snapshot.
+        The current generation is saved with the accounts.
+        
         Args:
             accounts (dict): The accounts data to save.
         """
-        with open(USER_DATA_FILE, "w") as file:
-            json.dump(accounts, file, indent=4)
+        tmp_file = USER_DATA_FILE + ".tmp"
+        snapshot = {'generation': self.generation, 'accounts': accounts}
+        with open(tmp_file, "wb") as file:
+            file.write(orjson.dumps(snapshot, default=list)) # deques are saved as lists
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, USER_DATA_FILE)
 
-    def handle_client(self, client):
+    def append_log(self, op, **args):
         """
-        Handles communication with a connected client.
+        Appends a mutation record to the log file. Must be called while holding the locks of the mutated accounts.
         
         Args:
-            client (socket): The client socket.
+            op (str): The name of the mutation, used to look up its replay function.
+            **args: The arguments of the mutation.
+        """
+        record = orjson.dumps({'op': op, 'args': args}, option=orjson.OPT_APPEND_NEWLINE)
+        with self.log_lock:
+            self.log_file.write(record) # buffered until the next flush
+            self.pending += 1
+        self.log_dirty.set()
+
+    def flush_loop(self):
+        """
+        Flushes and fsyncs the log in a background thread, once for all the records appended within each interval.
         """
         while True:
-            message = client.recv(1024).decode('utf-8')
-            if not message: # check if there is message
+            self.log_dirty.wait()
+            time.sleep(self.fsync_interval) # let the records of this interval pile up
+            self.log_dirty.clear()
+            with self.log_lock:
+                self.log_file.flush()
+                os.fsync(self.log_file.fileno())
+
+    def snapshot(self):
+        """
+        Writes the accounts to the JSON file and empties the log if there are pending mutations.
+        """
+        with self.lock.write():
+            if not self.pending:
+                return
+            self.generation += 1 # the snapshot includes every record logged so far
+            self.save_accounts(self.accounts)
+            self.start_log()
+            self.pending = 0
+
+    def snapshot_loop(self):
+        """
+        Periodically snapshots the accounts in a background thread. A failed snapshot, such as one that runs out of
+        disk space, is reported and tried again at the next interval, since its mutations are still pending.
+        """
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.snapshot()
+            except Exception:
+                traceback.print_exc()
+
+    def lock_for(self, username):
+        """
+        Returns the lock of a user, creating it on first use.
+        
+        Args:
+            username (str): The username of the account.
+        
+        Returns:
+            threading.Lock: The lock of the user.
+        """
+        lock = self.user_locks.get(username)
+        if lock is None:
+            with self.locks_guard:
+                lock = self.user_locks.setdefault(username, threading.Lock())
+        return lock
+
+    @contextmanager
+    def locked(self, *usernames):
+        """
+        Holds the global lock in shared mode and the locks of the given users.
+        
+        User locks are always taken in sorted order, so two requests can never wait on each other.
+        
+        Args:
+            *usernames (str): The usernames of the accounts the request touches.
+        """
+        with self.lock.read(), ExitStack() as stack:
+            for username in sorted(set(usernames)):
+                stack.enter_context(self.lock_for(username))
+            yield
+
+    def hash_password(self, password, salt):
+        """
+        Hashes a password with the salt of its account.
+        
+        Args:
+            password (str): The password sent by the client.
+            salt (bytes): The salt of the account.
+        
+        Returns:
+            bytes: The blake2b digest of the password.
+        """
+        return hashlib.blake2b(password.encode('utf-8'), digest_size=PASSWORD_DIGEST_SIZE, salt=salt).digest()
+
+    def check_password(self, account, password):
+        """
+        Checks a password against the one stored in an account.
+        
+        Args:
+            account (dict): The account.
+            password (str): The password sent by the client.
+        
+        Returns:
+            bool: True if the password is correct, False otherwise.
+        """
+        if 'pwhash' not in account: # account stored before passwords were hashed by the server
+            return hmac.compare_digest(account['password'].encode('utf-8'), password.encode('utf-8'))
+        pwhash = self.hash_password(password, bytes.fromhex(account['salt']))
+        return hmac.compare_digest(bytes.fromhex(account['pwhash']), pwhash)
+
+    def create_account(self, username, salt, pwhash):
+        """
+        Creates a new account with no messages.
+        
+        Args:
+            username (str): The username of the new account.
+            salt (str): The hex-encoded salt of the new account.
+            pwhash (str): The hex-encoded password hash of the new account.
+        """
+        self.accounts[username] = {'salt': salt, 'pwhash': pwhash, 'read_messages': [], 'unread_messages': deque()}
+        with self.directory_lock:
+            self.accounts_lower[username] = username.lower()
+            for trigram in trigrams(username.lower()):
+                self.trigram_index.setdefault(trigram, set()).add(username)
+
+    def store_message(self, sender, recipient, message):
+        """
+        Adds a message to the recipient's undelivered messages.
+        
+        Args:
+            sender (str): The username of the sender.
+            recipient (str): The username of the recipient.
+            message (str): The message content.
+        """
+        msg = {"from": sender, "message": message}
+        self.accounts[recipient]['unread_messages'].append(msg)
+        self.sent_by.setdefault(sender, {})[id(msg)] = (recipient, msg)
+
+    def mark_read(self, username, per_page):
+        """
+        Moves the oldest unread messages of a user to the user's read messages.
+        
+        Args:
+            username (str): The username of the account.
+            per_page (int): The number of messages to move.
+        
+        Returns:
+            list: The messages that were moved.
+        """
+        unread = self.accounts[username]['unread_messages']
+        unread_messages = [unread.popleft() for _ in range(min(per_page, len(unread)))]
+        self.accounts[username]['read_messages'].extend(unread_messages)
+        return unread_messages
+
+    def remove_message(self, username, idx):
+        """
+        Deletes a read message of a user.
+        
+        Args:
+            username (str): The username of the account.
+            idx (int): The index of the message in the user's read messages.
+        """
+        msg = self.accounts[username]["read_messages"].pop(idx)
+        self.sent_by.get(msg['from'], {}).pop(id(msg), None)
+
+    def remove_account(self, username):
+        """
+        Deletes an account and all messages sent from it, so that the recipients will no longer see these messages.
+        
+        Args:
+            username (str): The username of the account to delete.
+        """
+        # only the recipients of this user's messages need to be filtered
+        sent_ids = {}
+        for msg_id, (recipient, _) in self.sent_by.pop(username, {}).items():
+            sent_ids.setdefault(recipient, set()).add(msg_id)
+        for recipient, msg_ids in sent_ids.items():
+            account = self.accounts.get(recipient)
+            if account is None:
+                continue
+            account['unread_messages'] = deque(msg for msg in account['unread_messages'] if id(msg) not in msg_ids)
+            account['read_messages'] = [msg for msg in account['read_messages'] if id(msg) not in msg_ids]
+        # the messages this user received no longer need to be found by their senders
+        account = self.accounts.pop(username) # delete account
+        with self.directory_lock:
+            for trigram in trigrams(self.accounts_lower.pop(username)):
+                self.trigram_index[trigram].discard(username)
+                if not self.trigram_index[trigram]:
+                    del self.trigram_index[trigram]
+        for msg in itertools.chain(account['unread_messages'], account['read_messages']):
+            self.sent_by.get(msg['from'], {}).pop(id(msg), None)
+
+    def handle_login(self, data):
+        """
+        Logs a user in, or creates the account if it does not exist yet.
+        
+        Args:
+            data (dict): The request, with the username and password.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        username = data['username']
+        password = data['password']
+        with self.locked(username):
+            if username in self.accounts: # check if account  exists
+                if self.check_password(self.accounts[username], password): # check if password correct
+                    return {'status': 'success'}
+                return {'status': 'failure'}
+            # if account does not exist, create new account
+            salt = os.urandom(hashlib.blake2b.SALT_SIZE)
+            pwhash = self.hash_password(password, salt).hex()
+            self.create_account(username, salt.hex(), pwhash)
+            self.append_log('create_account', username=username, salt=salt.hex(), pwhash=pwhash)
+        return {'status': 'success', 'unread_messages': []}
+
+    def handle_send(self, data):
+        """
+        Sends a message to another user.
+        
+        Args:
+            data (dict): The request, with the sender, recipient and message.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        recipient = data['recipient']
+        with self.locked(data['sender'], recipient):
+            if recipient not in self.accounts: # check if recipient is a valid account
+                return {'status': 'failure', 'message': 'Invalid recipient. Please enter a valid username.'}
+            # save message to recipient's undelivered messages
+            self.store_message(data['sender'], recipient, data['message'])
+            self.append_log('store_message', sender=data['sender'], recipient=recipient, message=data['message'])
+        return {'status': 'success', 'message': 'Send message successfully.'}
+
+    def handle_read_unread(self, data):
+        """
+        Reads unread (undelivered) messages, moving them to the user's read messages.
+        
+        Args:
+            data (dict): The request, with the username and the number of messages user wants to read.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        username = data['username']
+        per_page = data['per_page']
+        with self.locked(username):
+            unread_messages = self.mark_read(username, per_page)
+            self.append_log('mark_read', username=username, per_page=per_page)
+        return {'status': 'success', 'messages': unread_messages}
+
+    def handle_read_all(self, data):
+        """
+        Reads all (delivered) messages of a user.
+        
+        Args:
+            data (dict): The request, with the username.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        username = data['username']
+        with self.locked(username):
+            messages = list(self.accounts[username]['read_messages'])
+        return {'status': 'success', 'messages': messages}
+
+    def handle_count_unread(self, data):
+        """
+        Gets the unread messages of a user, used to count them.
+        
+        Args:
+            data (dict): The request, with the username.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        username = data['username']
+        with self.locked(username):
+            unread_messages = list(self.accounts[username]['unread_messages'])
+        return {'status': 'success', 'unread_messages': unread_messages}
+
+    def handle_list(self, data):
+        """
+        Lists the accounts whose username contains the query, ignoring case, sorted by username.
+        
+        Args:
+            data (dict): The request, with the query.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        query = data['query'].lower() # query for searching accounts
+        with self.directory_lock:
+            if len(query) < 3: # too short to have a trigram, so scan every account
+                candidates = self.accounts_lower
+            else:
+                # only usernames that contain every trigram of the query can contain the query
+                sets = sorted((self.trigram_index.get(trigram, set()) for trigram in trigrams(query)), key=len)
+                candidates = sets[0].intersection(*sets[1:])
+            searched_accounts = sorted(acc for acc in candidates if query in self.accounts_lower[acc]) # accounts that contain query
+        return {'status': 'success', 'list_accounts': searched_accounts}
+
+    def handle_delete_message(self, data):
+        """
+        Deletes a read message of a user.
+        
+        Args:
+            data (dict): The request, with the username and the index of message the user wants to delete.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        username = data['username']
+        idx = data['idx']
+        with self.locked(username):
+            self.remove_message(username, idx) # delete message
+            self.append_log('remove_message', username=username, idx=idx)
+        return {'status': 'success'}
+
+    def handle_delete_account(self, data):
+        """
+        Deletes an account and all messages sent from it.
+        
+        Args:
+            data (dict): The request, with the username.
+        
+        Returns:
+            dict: The response to send back.
+        """
+        username = data['username']
+        # deleting the messages sent from this account can touch any account
+        with self.lock.write():
+            self.remove_account(username)
+            self.append_log('remove_account', username=username)
+        return {'status': 'success'}
+
+    def send_response(self, client, data):
+        """
+        Sends a length-prefixed JSON response to a client.
+        
+        Args:
+            client (socket): The client socket.
+            data (dict): The response to be sent.
+        """
+        payload = orjson.dumps(data)
+        header = len(payload).to_bytes(self.HEADER, 'big')
+        if not hasattr(client, 'sendmsg'): # not available on Windows
+            client.sendall(header + payload)
+            return
+        # send the header and the payload together in one syscall, without joining them into a new bytes object
+        sent = client.sendmsg([header, payload])
+        if sent < self.HEADER: # the kernel took only part of a large response, so send the rest
+            client.sendall(header[sent:])
+            sent = self.HEADER
+        if sent - self.HEADER < len(payload):
+            client.sendall(memoryview(payload)[sent - self.HEADER:])
+
+    def receive(self, conn):
+        """
+        Reads what a client has sent once the selector reports its socket readable, and queues every complete 
+        request in the buffer for a worker. Every request is a 4-byte length followed by that many bytes of JSON.
+        
+        Args:
+            conn (Connection): The connection of the client.
+        """
+        buffer = conn.buffer
+        if conn.end == len(buffer): # no room left to receive into
+            if conn.start: # move the start of an incomplete request to the front
+                buffer[:conn.end - conn.start] = buffer[conn.start:conn.end]
+                conn.end -= conn.start
+                conn.start = 0
+            else: # a single request is larger than the buffer
+                buffer.extend(bytes(len(buffer)))
+        try:
+            with memoryview(buffer) as view:
+                received = conn.client.recv_into(view[conn.end:])
+        except OSError:
+            received = 0
+        if not received: # the client closed the connection
+            self.disconnect(conn)
+            return
+        conn.end += received
+        messages = []
+        while conn.end - conn.start >= self.HEADER:
+            size = int.from_bytes(buffer[conn.start:conn.start + self.HEADER], 'big')
+            stop = conn.start + self.HEADER + size
+            if conn.end < stop: # the rest of this request has not arrived yet
                 break
-            data = json.loads(message)
-
-            # Handle different operations
-            # Login
-            if data['action'] == 'login':
-                username = data['username']
-                password = data['password']
-                if username in self.accounts: # check if account  exists
-                    if self.accounts[username]['password'] == password: # check if password correct
-                        client.send(json.dumps({'status': 'success'}).encode('utf-8'))
-                    else:
-                        client.send(json.dumps({'status': 'failure'}).encode('utf-8'))
-                else: # if account does not exist, create new account
-                    self.accounts[username] = {'password': password, 'read_messages': [], 'unread_messages': []}
-                    self.save_accounts(self.accounts)
-                    client.send(json.dumps({'status': 'success', 'unread_messages': []}).encode('utf-8'))
-
-            # Send a message
-            elif data['action'] == 'send':
-                recipient = data['recipient']
-                if recipient in self.accounts: # check if recipient is a valid account
-                    # save message to recipient's undelivered messages
-                    self.accounts[recipient]['unread_messages'].append({"from": data['sender'], "message": data['message']})
-                    self.save_accounts(self.accounts)
-                    client.send(json.dumps({'status': 'success', 'message': 'Send message successfully.'}).encode('utf-8'))
-                else:
-                    client.send(json.dumps({'status': 'failure', 'message': 'Invalid recipient. Please enter a valid username.'}).encode('utf-8'))
-            
-            # Read unread (undelivered) messaages
-            elif data['action'] == 'read_unread':
-                username = data['username']
-                per_page = data['per_page'] # the number of messages user wants to read
-                unread_messages = self.accounts[username]['unread_messages'][:per_page]
-
-                # move messages from unread messages to read messages
-                self.accounts[username]['read_messages'].extend(unread_messages)
-                self.accounts[username]['unread_messages'] = self.accounts[username]['unread_messages'][per_page:]
-                self.save_accounts(self.accounts)
-
-                client.send(json.dumps({'status': 'success', 'messages': unread_messages}).encode('utf-8'))
-
-            # Read all (delivered) messages
-            elif data['action'] == 'read_all':
-                username = data['username']
-                messages = self.accounts[username]['read_messages']
-
-                client.send(json.dumps({'status': 'success', 'messages': messages}).encode('utf-8'))
-
-            # Count unread messages
-            elif data['action'] == "count_unread":
-                username = data['username']
-
-                client.send(json.dumps({'status': 'success', 'unread_messages': self.accounts[username]['unread_messages']}).encode('utf-8'))
-            
-            # List accounts
-            elif data['action'] == "list":
-                query = data['query'].lower() # query for searching accounts
-                accounts = list(self.accounts.keys())
-                searched_accounts = [acc for acc in accounts if query in acc.lower()] # accounts that contain query
-
-                client.send(json.dumps({'status': 'success', 'list_accounts': searched_accounts}).encode('utf-8'))
-            
-            # Delete message
-            elif data['action'] == "delete_message":
-                username = data['username']
-                idx = data['idx'] # index of message the user wants to delete
-                del self.accounts[username]["read_messages"][idx] # delete message
-                self.save_accounts(self.accounts)
-
-                client.send(json.dumps({'status': 'success'}).encode('utf-8'))
-            
-            # Delete account
-            elif data['action'] == "delete_account":
-                username = data['username']
-
-                # delete all messages sent from this accounts, so that the recipients will no longer see these messages
-                for user in self.accounts:
-                    i_un = len(self.accounts[user]['unread_messages'])-1
-                    for un_m in self.accounts[user]['unread_messages'][::-1]:
-                        if un_m['from'] == username:
-                            del self.accounts[user]['unread_messages'][i_un]
-                        i_un -= 1
-                    i_r = len(self.accounts[user]['read_messages'])-1
-                    for r_m in self.accounts[user]['read_messages'][::-1]:
-                        if r_m['from'] == username:
-                            del self.accounts[user]['read_messages'][i_r]
-                        i_r -= 1
-                del self.accounts[username] # delete account
-                self.save_accounts(self.accounts)
-
-                client.send(json.dumps({'status': 'success'}).encode('utf-8'))
+            with memoryview(buffer) as view:
+                messages.append(bytes(view[conn.start + self.HEADER:stop]))
+            conn.start = stop
+        if conn.start == conn.end:
+            conn.start = conn.end = 0
+        if not messages:
+            return
+        with conn.lock:
+            conn.requests.extend(messages)
+            if conn.busy: # the worker already serving this connection will handle them in order
+                return
+            conn.busy = True
+        self.pool.submit(self.serve, conn)
 
-    def start(self):
+    def disconnect(self, conn):
+        """
+        Stops watching a connection the client has closed. The socket is closed once no worker is using it any more.
+        
+        Args:
+            conn (Connection): The connection of the client.
         """
-        Starts the server and listens for incoming client connections.
+        self.selector.unregister(conn.client)
+        with conn.lock:
+            conn.closed = True
+            if conn.busy:
+                return
+        conn.client.close()
+
+    def serve(self, conn):
+        """
+        Handles the queued requests of a connection one at a time in a worker thread, so its responses are sent in 
+        the order of the requests.
+        
+        Args:
+            conn (Connection): The connection of the client.
         """
         while True:
+            with conn.lock:
+                if not conn.requests:
+                    conn.busy = False
+                    if conn.closed:
+                        conn.client.close()
+                    return
+                message = conn.requests.popleft()
+            try:
+                self.handle_request(conn.client, message)
+            except Exception as e:
+                if not isinstance(e, OSError): # an OSError only means the client went away while we replied
+                    traceback.print_exc()
+                with conn.lock:
+                    conn.requests.clear()
+                try:
+                    conn.client.shutdown(socket.SHUT_RDWR) # the event loop then disconnects it
+                except OSError:
+                    pass
+
+    def handle_request(self, client, message):
+        """
+        Handles a single request from a client.
+        
+        Args:
+            client (socket): The client socket.
+            message (bytes): The JSON request, without its length header.
+        """
+        data = orjson.loads(message) # orjson parses the received bytes directly
+
+        # look up the handler of the action instead of comparing it against every action in turn
+        handler = self.handlers.get(data['action'])
+        if handler is None:
+            self.send_response(client, {'status': 'failure', 'message': 'Unknown action.'})
+        else:
+            self.send_response(client, handler(data))
+
+    def configure_client(self, client):
+        """
+        Tunes a newly accepted client socket for small request/response messages.
+        
+        Args:
+            client (socket): The client socket.
+        """
+        # send small responses right away instead of waiting for the client to ACK (Nagle's algorithm)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        if hasattr(socket, 'TCP_QUICKACK'): # Linux only
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+    def accept(self):
+        """
+        Accepts a waiting client connection and starts watching it for requests.
+        """
+        try:
             client, address = self.server.accept()
-            print(f"Connected with {str(address)}")
-            threading.Thread(target=self.handle_client, args=(client,)).start()
+        except BlockingIOError: # another connection attempt was given up
+            return
+        print(f"Connected with {str(address)}")
+        client.setblocking(True) # responses are sent by workers with sendall
+        self.configure_client(client)
+        self.selector.register(client, selectors.EVENT_READ, Connection(client))
+
+    def start(self):
+        """
+        Starts the server and runs the event loop, which accepts connections and reads requests from every client 
+        in one thread. Requests are handled by the worker pool.
+        """
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    self.accept()
+                else:
+                    self.receive(key.data)
 
 
 if __name__ == "__main__":
@@ -169,5 +791,6 @@ if __name__ == "__main__":
     config.read('config.ini')
     host = config['server']['host']
     port = int(config['server']['port'])
-    server = Server(host, port)
+    fsync_interval_ms = config['server'].getint('fsync_interval_ms', FSYNC_INTERVAL_MS)
+    server = Server(host, port, fsync_interval_ms)
     server.start()
@@ -1,6 +1,9 @@
 import unittest
 import threading
 import time
+import os
+import tempfile
+from unittest import mock
 import client
 import server
 
@@ -9,6 +12,12 @@ class TestClientServer(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Start the server in a separate thread before running any tests."""
+        # keep the accounts and log of the tests out of the real data files
+        cls.data_dir = tempfile.TemporaryDirectory()
+        cls.data_files = [mock.patch.object(server, 'USER_DATA_FILE', os.path.join(cls.data_dir.name, 'accounts.json')),
+                          mock.patch.object(server, 'USER_LOG_FILE', os.path.join(cls.data_dir.name, 'accounts.log'))]
+        for patcher in cls.data_files:
+            patcher.start()
         cls.server = server.Server(host='127.0.0.1', port=5555)
         cls.server_thread = threading.Thread(target=cls.server.start)
         cls.server_thread.daemon = True  # Daemonize thread to exit when the main program exits
@@ -22,6 +31,10 @@ class TestClientServer(unittest.TestCase):
         """Clean up after all tests are done."""
         # Close the server socket (if needed)
         cls.server.server.close()
+        cls.server.pending = 0 # nothing left for the snapshot thread to write once the files are unpatched
+        for patcher in cls.data_files:
+            patcher.stop()
+        cls.data_dir.cleanup()
 
     def setUp(self):
         """Initialize the client for each test."""
@@ -69,6 +82,15 @@ class TestClientServer(unittest.TestCase):
         self.assertTrue(result)
         self.assertIn('new_user', self.server.accounts)
 
+    def test_login_new_user_hashes_password(self):
+        """Test that a new account stores a password hash that later logins are checked against."""
+        self.server.accounts = {}
+        self.assertTrue(self.client.login('new_user', 'hashed_password'))
+        self.assertNotIn('password', self.server.accounts['new_user'])
+        self.assertNotEqual(self.server.accounts['new_user']['pwhash'], 'hashed_password')
+        self.assertTrue(self.client.login('new_user', 'hashed_password'))
+        self.assertFalse(self.client.login('new_user', 'wrong_password'))
+
     def test_login_wrong_password(self):
         """Test logging in with a wrong password for an existing user."""
         # Add a user to the server's accounts
@@ -85,6 +107,18 @@ class TestClientServer(unittest.TestCase):
         result = self.client.list_accounts('')
         self.assertEqual(result, ['user1', 'user2', 'user3'])
 
+    def test_idle_connections_do_not_block_requests(self):
+        """Test that clients are answered while more connections than workers are open and idle."""
+        self.server.accounts = {'user1': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
+        idle_clients = [client.Client(host='127.0.0.1', port=5555) for _ in range(server.MAX_WORKERS + 1)]
+        test_client = client.Client(host='127.0.0.1', port=5555)
+        try:
+            test_client.client.settimeout(5) # fail instead of hanging if no worker is free
+            self.assertEqual(test_client.list_accounts(''), ['user1'])
+        finally:
+            for idle_client in idle_clients + [test_client]:
+                idle_client.client.close()
+
     def test_list_accounts_with_query(self):
         """Test listing accounts with a search query."""
         self.server.accounts = {'user1': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
@@ -93,6 +127,15 @@ class TestClientServer(unittest.TestCase):
         result = self.client.list_accounts('user2')
         self.assertEqual(result, ['user2'])
 
+    def test_list_accounts_with_long_query(self):
+        """Test that queries long enough to use the trigram index ignore case and find substrings."""
+        self.server.accounts = {'Alice': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
+                                'malicious': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
+                                'bob': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
+        self.assertEqual(self.client.list_accounts('ALIC'), ['Alice', 'malicious'])
+        self.assertEqual(self.client.list_accounts('licious'), ['malicious'])
+        self.assertEqual(self.client.list_accounts('alix'), [])
+
     def test_send_message_valid_recipient(self):
         """Test sending a message to a valid recipient."""
         self.server.accounts = {'sender': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
@@ -110,6 +153,18 @@ class TestClientServer(unittest.TestCase):
         self.assertEqual(status, False)
         self.assertEqual(result, 'Invalid recipient. Please enter a valid username.')
 
+    def test_send_long_message(self):
+        """Test that a message longer than a single recv buffer arrives intact."""
+        self.server.accounts = {'sender': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
+                                'recipient': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
+        message = 'a' * 5000
+        self.client.username = 'sender'
+        status, _ = self.client.send_message('recipient', message)
+        self.assertTrue(status)
+        self.client.username = 'recipient'
+        result = self.client.read_unread_messages(1)
+        self.assertEqual(result, [{'from': 'sender', 'message': message}])
+
     def test_read_unread_messages(self):
         """Test reading unread messages."""
         self.server.accounts = {'user': {'password':'123','unread_messages': [{'from': 'sender', 'message': 'Hello'}],
@@ -143,8 +198,76 @@ class TestClientServer(unittest.TestCase):
         result = self.client.delete_account()
         self.assertEqual(result, 'Delete account successfully.')
         self.assertNotIn('user', self.server.accounts)
-        self.assertEqual(self.server.accounts['other_user']['unread_messages'], [])
+        self.assertEqual(list(self.server.accounts['other_user']['unread_messages']), [])
+
+
+    def test_delete_account_removes_sent_messages(self):
+        """Test that deleting an account removes its read and unread messages but keeps other senders' messages."""
+        self.server.accounts = {'user': {'password':'123', 'unread_messages': [], 'read_messages':[]}, 
+                                'other_user': {'password':'123', 
+                                               'read_messages': [{'from': 'user', 'message': 'Hi'}, {'from': 'friend', 'message': 'Hey'}], 
+                                               'unread_messages': [{'from': 'friend', 'message': 'Hello'}, {'from': 'user', 'message': 'Bye'}]}}
+        self.client.username = 'user'
+        self.client.send_message('other_user', 'Hello again')
+        result = self.client.delete_account()
+        self.assertEqual(result, 'Delete account successfully.')
+        self.assertEqual(self.server.accounts['other_user']['read_messages'], [{'from': 'friend', 'message': 'Hey'}])
+        self.assertEqual(list(self.server.accounts['other_user']['unread_messages']), [{'from': 'friend', 'message': 'Hello'}])
+
+
+class TestRecovery(unittest.TestCase):
+    """Restarts servers on the same snapshot and log, in a directory of their own."""
+
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        self.log_path = os.path.join(data_dir.name, 'accounts.log')
+        for name, path in (('USER_DATA_FILE', os.path.join(data_dir.name, 'accounts.json')), ('USER_LOG_FILE', self.log_path)):
+            patcher = mock.patch.object(server, name, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start_server(self):
+        """Start a server on the test's data files; it is not listening, the handlers are called directly."""
+        chat_server = server.Server(host='127.0.0.1', port=0)
+        self.addCleanup(chat_server.server.close)
+        self.addCleanup(setattr, chat_server, 'pending', 0) # its snapshot thread outlives the test
+        return chat_server
+
+    def test_restart_after_interrupted_snapshot(self):
+        """Test that a log already included in the snapshot is not replayed again."""
+        chat_server = self.start_server()
+        chat_server.handle_login({'username': 'recipient', 'password': '123'})
+        chat_server.snapshot()
+        chat_server.handle_send({'sender': 'recipient', 'recipient': 'recipient', 'message': 'Once'})
+        chat_server.log_file.flush()
+        with open(self.log_path, 'rb') as log_file:
+            log = log_file.read()
+        chat_server.snapshot()
+        with open(self.log_path, 'wb') as log_file: # as if the crash came before the log was emptied
+            log_file.write(log)
+
+        restarted = self.start_server()
+        self.assertEqual(list(restarted.accounts['recipient']['unread_messages']), [{'from': 'recipient', 'message': 'Once'}])
+
+    def test_restart_after_torn_record(self):
+        """Test that a record torn by a crash is cut off, so the records appended after it survive the next restart."""
+        chat_server = self.start_server()
+        chat_server.handle_login({'username': 'alice', 'password': '123'})
+        chat_server.log_file.write(b'{"op": "create_acc') # the crash stops a write halfway
+        chat_server.log_file.flush()
+
+        restarted = self.start_server()
+        restarted.handle_login({'username': 'bob', 'password': '123'})
+        restarted.log_file.flush()
+        self.assertEqual(sorted(self.start_server().accounts), ['alice', 'bob'])
 
+    def test_corrupt_log_stops_startup(self):
+        """Test that a complete record that cannot be applied stops the server from starting."""
+        with open(self.log_path, 'wb') as log_file:
+            log_file.write(b'{"generation":0}\n{"op":"remove_account","args":{"username":"nobody"}}\n')
+        with self.assertRaises(KeyError):
+            server.Server(host='127.0.0.1', port=0)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,16 +1,19 @@
 import socket
+import threading
+import zlib
 import tkinter as tk
 from tkinter import messagebox
 import hashlib
-from protocol import serialize, deserialize
+from protocol import serialize_into, deserialize, unpack_messages, FIELD_LEN, ACK_LEN, COMPRESSED
 from operation import Operations
 
 class Client:
     """
     A client for a chat application, handling communication with the server.
     """
-    HEADER = 64 # size of message that indicates the next message size
+    HEADER = 4 # size of message that indicates the next message size, a big-endian unsigned 32-bit integer
     VERSION = "1" # protocal version number
+    SEND_BUFFER_SIZE = 4096 # initial size of the reusable buffer outgoing frames are written into
 
     def __init__(self, host='127.0.0.1', port=5555):
         """
@@ -24,46 +27,77 @@ class Client:
         self.port = port
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client.connect((self.host, self.port))
+        self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # send small requests right away
+        self.send_buffer = bytearray(self.SEND_BUFFER_SIZE)
+        self.lock = threading.Lock() # one request at a time on this connection
         self.username = None
+        self.unread_count = 0 # number of unread messages reported by the last successful login
 
-    def send_recv(self, operation, msg):
+    def recv_exact(self, size):
         """
-        Sends a serialized request to the server and receives a response.
+        Receives exactly the given number of bytes from the server, since a single recv may return fewer.
         
         Args:
-            operation (str): A two-character operation code.
-            msg (str): The message to be sent.
+            size (int): The number of bytes to receive.
         
         Returns:
-            dict: The deserialized response from the server.
+            bytearray: The received bytes.
+        
+        Raises:
+            ConnectionError: If the server closes the connection before all bytes arrive.
         """
-        serialized_data = serialize({"version": self.VERSION, "operation": operation, "info": msg}) # the message to be sent
-        msg_len = len(serialized_data)
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.client.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("No returned message from server.")
+            data.extend(chunk)
+        return data
+
+    def send_request(self, operation, msg):
+        """
+        Serializes a request and sends it to the server.
         
-        send_len = str(msg_len).encode('utf-8') # length of message to be sent
-        send_len += b" " * (self.HEADER - len(send_len)) # padding of message size
+        Args:
+            operation (Operations): The operation code.
+            msg (list): The fields to be sent.
+        """
+        frame_len = serialize_into({"version": self.VERSION, "operation": operation, "info": msg}, self.send_buffer) # length header and message
+        self.client.sendall(memoryview(self.send_buffer)[:frame_len]) # send message length and message in one write
 
-        self.client.send(send_len) # send message length
-        self.client.send(serialized_data) # send message
+    def recv_response(self):
+        """
+        Receives one response from the server.
+        
+        Returns:
+            dict: The deserialized response from the server.
+        """
+        msg_len = FIELD_LEN.unpack(self.recv_exact(self.HEADER))[0]
+        returned_data = self.recv_exact(msg_len & ~COMPRESSED) # receive message with length=msg_len
+        if msg_len & COMPRESSED: # the server compressed a long message
+            returned_data = zlib.decompress(returned_data)
+        elif msg_len == ACK_LEN: # ack frame, only a status code and nothing to deserialize
+            return {"version": self.VERSION, "operation": Operations(returned_data[0]), "info": []}
+        deserialized_data = deserialize(returned_data) # deserialize data
+        if deserialized_data["version"] == self.VERSION: # check version
+            return deserialized_data
+        print("Incorrect version.")
 
-        msg_len = self.client.recv(self.HEADER).decode('utf-8') 
-        connection_flag = True
-        while connection_flag: 
-            if msg_len:
-                msg_len = int(msg_len)
-            else:
-                msg_len = 1
-            returned_data = self.client.recv(msg_len) # receive message with length=msg_len
-            if len(returned_data): # if there is message
-                deserialized_data = deserialize(returned_data) # deserialize data
-                if deserialized_data["version"] == self.VERSION: # check version
-                    return deserialized_data
-                else:
-                    print("Incorrect version.")
-                    connection_flag = False
-            else:
-                print("No returned message from server.")
-                return
+    def send_recv(self, operation, msg):
+        """
+        Sends a serialized request to the server and receives a response. The connection is held for the whole 
+        round trip so requests from different threads cannot interleave their frames.
+        
+        Args:
+            operation (Operations): The operation code.
+            msg (list): The fields to be sent.
+        
+        Returns:
+            dict: The deserialized response from the server.
+        """
+        with self.lock:
+            self.send_request(operation, msg)
+            return self.recv_response()
 
     def send_message(self, recipient, message):
         """
@@ -76,12 +110,12 @@ class Client:
         Returns:
             tuple: A boolean indicating success, and the server's response message.
         """
-        info = self.username + '\n' + recipient + '\n' + message # encode info sent to server
+        info = [self.username, recipient, message]
         response = self.send_recv(Operations.SEND_MESSAGE, info)
         if response['operation'] == Operations.SUCCESS:
-            return True, response['info']
+            return True, response['info'][0]
         else:
-            return False, response['info']
+            return False, response['info'][0]
 
     def read_unread_messages(self, per_page):
         """
@@ -93,16 +127,10 @@ class Client:
         Returns:
             list: A list of unread messages, each represented as a dictionary.
         """
-        info = self.username + '\n' + str(per_page) # encode info sent to server
+        info = [self.username, str(per_page)]
         response = self.send_recv(Operations.READ_UNREAD, info) 
         if response['operation'] == Operations.SUCCESS:
-            unread_messages = []
-            if response['info'] == '':
-                return unread_messages
-            for line in response['info'].split("\n\t\n"): # split each unread message, each in the format "sender message"
-                sender, message = line.split(" ", 1) # separate sender and message
-                unread_messages.append({"from": sender, "message": message})
-            return unread_messages
+            return unpack_messages(response['info']) # alternating sender and message fields
         else:
             messagebox.showerror("Error", "Failed to read messages.")
             return []
@@ -114,16 +142,10 @@ class Client:
         Returns:
             list: A list of read messages, each represented as a dictionary.
         """
-        info = self.username
+        info = [self.username]
         response = self.send_recv(Operations.READ_ALL, info)
         if response['operation'] == Operations.SUCCESS:
-            read_messages = []
-            if response['info'] == '':
-                return read_messages
-            for line in response['info'].split("\n\t\n"): # split each unread message, each in the format "sender message"
-                sender, message = line.split(" ", 1) # separate sender and message
-                read_messages.append({"from": sender, "message": message})
-            return read_messages
+            return unpack_messages(response['info']) # alternating sender and message fields
         else:
             messagebox.showerror("Error", "Failed to read messages.")
             return []
@@ -135,23 +157,56 @@ class Client:
         Returns:
             list: A list of unread messages, each represented as a dictionary.
         """
-        info = self.username
+        info = [self.username]
         response = self.send_recv(Operations.COUNT_UNREAD, info)
         if response['operation'] == Operations.SUCCESS:
-            unread_messages = []
-            if response['info'] == '':
-                return unread_messages
-            for line in response['info'].split("\n\t\n"): # split each unread message, each in the format "sender message"
-                sender, message = line.split(" ", 1) # separate sender and message
-                unread_messages.append({"from": sender, "message": message})
-            return unread_messages
+            return unpack_messages(response['info']) # alternating sender and message fields
         else:
             messagebox.showerror("Error", "Failed to get unread messages.")
             return []
         
+    def wait_unread(self, known_count):
+        """
+        Request the number of unread messages, which the server holds until it differs from known_count or times out.
+        
+        Args:
+            known_count (int): The unread count the caller already has, or -1 if it has none.
+        
+        Returns:
+            int: The current number of unread messages, or -1 if the account no longer exists.
+        """
+        with self.lock:
+            self.start_wait_unread(known_count)
+            return self.finish_wait_unread()
+
+    def start_wait_unread(self, known_count):
+        """
+        Sends a request for the number of unread messages without waiting for the reply, so the caller can 
+        collect it with finish_wait_unread once the connection is readable.
+        
+        Args:
+            known_count (int): The unread count the caller already has, or -1 if it has none.
+        """
+        info = [self.username, str(known_count)]
+        self.send_request(Operations.WAIT_UNREAD, info)
+
+    def finish_wait_unread(self):
+        """
+        Receives the reply to a request sent by start_wait_unread.
+        
+        Returns:
+            int: The current number of unread messages, or -1 if the account no longer exists.
+        """
+        response = self.recv_response()
+        if response['operation'] == Operations.SUCCESS:
+            return int(response['info'][0])
+        else:
+            return -1
+
     def login(self, username, password):
         """
         Request to authenticate the user with the provided credentials and get response from server.
+        The server answers a successful login with the user's unread count, which is kept in self.unread_count.
         
         Args:
             username (str): The username of the account.
@@ -160,10 +215,11 @@ class Client:
         Returns:
             bool: True if login was successful, False otherwise.
         """
-        info = username + '\n' + password # encode info sent to server
+        info = [username, password]
         response = self.send_recv(Operations.LOGIN, info)
         if response['operation'] == Operations.SUCCESS:
             self.username = username
+            self.unread_count = int(response['info'][0])
             return True
         else:
             return False
@@ -178,10 +234,10 @@ class Client:
         Returns:
             list: A list of usernames matching the query, or an error message if the operation fails.
         """
-        info = self.username + '\n' + query # encode info sent to server
+        info = [self.username, query]
         response = self.send_recv(Operations.LIST_ACCOUNTS, info)
         if response['operation'] == Operations.SUCCESS:
-            return response['info'].split('\n')
+            return response['info']
         else:
             return 'Fail to get accounts list.'
     
@@ -197,7 +253,7 @@ class Client:
         Returns:
             str: A success or failure message.
         """
-        info = self.username + '\n' + str(idx) # encode info sent to server
+        info = [self.username, str(idx)]
         response = self.send_recv(Operations.DELETE_MESSAGE, info)
         if response['operation'] == Operations.SUCCESS:
             return 'Delete message successfully.'
@@ -211,7 +267,7 @@ class Client:
         Returns:
             str: A success or failure message.
         """
-        info = self.username
+        info = [self.username]
         response = self.send_recv(Operations.DELETE_ACCOUNT, info)
         if response['operation'] == Operations.SUCCESS:
             return 'Delete account successfully.'
@@ -233,6 +289,11 @@ class ChatApp:
         self.root = root
         self.root.geometry("600x350")
         self.client = Client(host, port)
+        self.notifier = Client(host, port) # separate connection for long-polling the unread count
+        self.unread_count = -1 # latest unread count from the server, -1 if unknown
+        self.polling = False # whether a long-poll is waiting on the server
+        self.pages = {} # page name -> frame, built on first visit and reused afterwards
+        self.current_page = None # name of the cached page being shown, None for result pages
         print('init')
         self.setup_login_page()
 
@@ -241,13 +302,14 @@ class ChatApp:
         Sets up the login/signup page.
         """
         print('setup_login_page')
-        self.clear_window()
-        self.root.title("Log in/Sign up")
-        tk.Label(self.root, text="(create a new account if the username has not been signed up)").pack()
-        tk.Label(self.root, text="Username:").pack()
-        self.username_entry = tk.Entry(self.root) # get username entry
-        self.username_entry.pack()
-        tk.Button(self.root, text="Next", command=self.validate_username).pack()
+        page, created = self.show_page("login", "Log in/Sign up")
+        if created:
+            tk.Label(page, text="(create a new account if the username has not been signed up)").pack()
+            tk.Label(page, text="Username:").pack()
+            self.username_entry = tk.Entry(page) # get username entry
+            self.username_entry.pack()
+            tk.Button(page, text="Next", command=self.validate_username).pack()
+        self.username_entry.delete(0, "end")
 
     def validate_username(self):
         """
@@ -266,14 +328,17 @@ class ChatApp:
         Navigates to the password entry page.
         """
         self.username = self.username_entry.get()
-        self.clear_window()
-        self.root.title("Log in/Sign up")
-        tk.Label(self.root, text="(If the username does not exist, enter the password to sign up.)").pack()
-        tk.Label(self.root, text="Password:").pack()
-        self.password_entry = tk.Entry(self.root, show="*") # get password entry
-        self.password_entry.pack()
-        tk.Button(self.root, text="Log in/Sign up", command=self.login).pack()
-        tk.Button(self.root, text="Back", command=self.setup_login_page).pack()
+        page, created = self.show_page("password", "Log in/Sign up")
+        if created:
+            tk.Label(page, text="(If the username does not exist, enter the password to sign up.)").pack()
+            tk.Label(page, text="Password:").pack()
+            self.password_entry = tk.Entry(page, show="*") # get password entry
+            self.password_entry.pack()
+            self.login_button = tk.Button(page, text="Log in/Sign up", command=self.login)
+            self.login_button.pack()
+            tk.Button(page, text="Back", command=self.setup_login_page).pack()
+        self.password_entry.delete(0, "end")
+        self.login_button.config(state="normal")
 
     def hash_password(self, password):
         """
@@ -292,47 +357,124 @@ class ChatApp:
         Logs the user in or registers a new account if the username does not exist.
         """
         password = self.hash_password(self.password_entry.get())
-        success = self.client.login(self.username, password)
+        self.login_button.config(state="disabled") # one login request at a time on the shared connection
+        threading.Thread(target=self.login_request, args=(self.username, password), daemon=True).start()
+
+    def login_request(self, username, password):
+        """
+        Sends the login request off the Tk main thread so the window stays responsive during the round trip.
+        
+        Args:
+            username (str): The username of the account.
+            password (str): The hashed password.
+        """
+        success = self.client.login(username, password)
+        self.root.after(0, self.finish_login, success, self.client.unread_count)
+
+    def finish_login(self, success, unread_count):
+        """
+        Shows the result of a login request on the Tk main thread.
+        
+        Args:
+            success (bool): Whether the login was successful.
+            unread_count (int): The number of unread messages returned with the login.
+        """
         if success:
+            self.unread_count = unread_count # shown right away, the long-poll then waits for it to change
             self.setup_account_page()
         else:
+            self.login_button.config(state="normal")
             messagebox.showerror("Error", 'Incorrect password.')
 
     def setup_account_page(self):
         """
         Sets up the account dashboard after a successful login.
         """
-        self.clear_window()
-        self.root.title("Account - " + self.username)
-        self.unread_label = tk.Label(self.root, text="Checking messages...")
-        self.unread_label.pack()
-        tk.Button(self.root, text="List accounts", command=self.setup_list_accounts_page).pack()
-        tk.Button(self.root, text="Send messages", command=self.setup_send_message_page).pack()
-        tk.Button(self.root, text="Read messages", command=self.read_messages).pack()
-        tk.Button(self.root, text="Delete account", command=self.delete_account).pack()
-        tk.Button(self.root, text="Log out", command=self.setup_login_page).pack()
+        page, created = self.show_page("account", "Account - " + self.username)
+        if created:
+            self.unread_label = tk.Label(page)
+            self.unread_label.pack()
+            tk.Button(page, text="List accounts", command=self.setup_list_accounts_page).pack()
+            tk.Button(page, text="Send messages", command=self.setup_send_message_page).pack()
+            tk.Button(page, text="Read messages", command=self.read_messages).pack()
+            tk.Button(page, text="Delete account", command=self.delete_account).pack()
+            tk.Button(page, text="Log out", command=self.setup_login_page).pack()
+        if self.unread_count >= 0:
+            self.unread_label.config(text=f"({self.unread_count} unread messages)")
+        else:
+            self.unread_label.config(text="Checking messages...")
         self.refresh_unread_messages() 
 
     def refresh_unread_messages(self):
         """
-        Refreshes the unread messages count every second to notify logged-in users about new undelivered messages immediately. 
+        Starts a long-poll for the unread messages count in the background, so logged-in users are notified about 
+        new undelivered messages as soon as they arrive. Only one long-poll waits on the server at a time.
+        """
+        if not self.polling:
+            self.polling = True
+            if hasattr(self.root.tk, "createfilehandler"): # POSIX Tk can watch the socket from its own event loop
+                username = self.username
+                self.notifier.username = username
+                self.notifier.start_wait_unread(self.unread_count)
+                self.root.tk.createfilehandler(self.notifier.client, tk.READABLE, 
+                                               lambda sock, mask: self.on_unread_ready(username))
+            else:
+                threading.Thread(target=self.wait_unread_messages, args=(self.username, self.unread_count), daemon=True).start()
+
+    def on_unread_ready(self, username):
+        """
+        Reads the long-poll reply once the notifier connection is readable, then shows the count.
+        
+        Args:
+            username (str): The user whose unread messages are counted.
+        """
+        self.root.tk.deletefilehandler(self.notifier.client)
+        count = self.notifier.finish_wait_unread()
+        self.show_unread_count(username, count)
+
+    def wait_unread_messages(self, username, known_count):
+        """
+        Waits on the server until the unread count changes, then passes it to the Tk main thread. 
+        Used where Tk cannot watch sockets (Windows).
+        
+        Args:
+            username (str): The user whose unread messages are counted.
+            known_count (int): The unread count currently shown, or -1 if unknown.
+        """
+        self.notifier.username = username
+        count = self.notifier.wait_unread(known_count)
+        self.root.after(0, self.show_unread_count, username, count)
+
+    def show_unread_count(self, username, count):
         """
-        if hasattr(self, "unread_label") and self.unread_label.winfo_exists():
-            unread_messages = self.client.get_unread() 
-            self.unread_label.config(text=f"({len(unread_messages)} unread messages)")
-            self.root.after(1000, self.refresh_unread_messages)
+        Shows the unread count returned by a long-poll and starts the next one while the account page is open.
+        
+        Args:
+            username (str): The user the count belongs to.
+            count (int): The number of unread messages.
+        """
+        self.polling = False
+        if username != self.username: # the user logged out while the long-poll was waiting
+            self.unread_count = -1
+        else:
+            self.unread_count = count
+        if self.current_page == "account":
+            if self.unread_count >= 0:
+                self.unread_label.config(text=f"({self.unread_count} unread messages)")
+            self.refresh_unread_messages()
 
     def setup_list_accounts_page(self):
         """
         Sets up the account search page.
         """
-        self.clear_window()
-        self.root.title("Search accounts")
-        tk.Label(self.root, text="Search for existing accounts").pack()
-        self.search_entry = tk.Entry(self.root) # get query entry
-        self.search_entry.pack()
-        tk.Button(self.root, text="Search", command=self.list_accounts).pack()
-        tk.Button(self.root, text="Back", command=self.setup_account_page).pack()
+        page, created = self.show_page("search", "Search accounts")
+        if created:
+            tk.Label(page, text="Search for existing accounts").pack()
+            self.search_entry = tk.Entry(page) # get query entry
+            self.search_entry.pack()
+            tk.Button(page, text="Search", command=self.list_accounts).pack()
+            tk.Button(page, text="Back", command=self.setup_account_page).pack()
+        self.search_entry.delete(0, "end")
 
     def list_accounts(self):
         """
@@ -343,22 +485,7 @@ class ChatApp:
         self.clear_window()
         self.root.title("Accounts List")
 
-        # add scroll bar
-        main_frame = tk.Frame(self.root)
-        main_frame.pack(fill="both", expand=True)
-        canvas = tk.Canvas(main_frame)
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar = tk.Scrollbar(main_frame, orient="vertical", command=canvas.yview)
-        scrollbar.pack(side="right", fill="y")
-        account_frame = tk.Frame(canvas)
-        canvas.create_window((0, 0), window=account_frame, anchor="n", width=self.root.winfo_width())
-        canvas.configure(yscrollcommand=scrollbar.set)
-        for user in response:
-            user_frame = tk.Frame(account_frame)
-            user_frame.pack(fill="x", expand=True)
-            tk.Label(user_frame, text=user).pack(anchor="center", pady=1)
-        account_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.bind_all("<MouseWheel>", lambda e: canvas.yview_scroll(-1 * (e.delta // 120), "units"))
+        self.setup_text_list(response) # one Text widget with a line per account, however many there are
         tk.Button(self.root, text="Back", command=self.setup_account_page).pack()
 
     def setup_send_message_page(self):
@@ -368,16 +495,18 @@ class ChatApp:
         Ask user to enter the recipient and message. Provides buttons to send the message or 
         navigate back to the account page.
         """
-        self.clear_window()
-        self.root.title("Send messages")
-        tk.Label(self.root, text="Recipient:").pack()
-        self.recipient_entry = tk.Entry(self.root)
-        self.recipient_entry.pack()
-        tk.Label(self.root, text="Message:").pack()
-        self.message_entry = tk.Entry(self.root)
-        self.message_entry.pack()
-        tk.Button(self.root, text="Send", command=self.send_message).pack()
-        tk.Button(self.root, text="Back", command=self.setup_account_page).pack()
+        page, created = self.show_page("send", "Send messages")
+        if created:
+            tk.Label(page, text="Recipient:").pack()
+            self.recipient_entry = tk.Entry(page)
+            self.recipient_entry.pack()
+            tk.Label(page, text="Message:").pack()
+            self.message_entry = tk.Entry(page)
+            self.message_entry.pack()
+            tk.Button(page, text="Send", command=self.send_message).pack()
+            tk.Button(page, text="Back", command=self.setup_account_page).pack()
+        self.recipient_entry.delete(0, "end")
+        self.message_entry.delete(0, "end")
 
     def send_message(self):
         """
@@ -401,9 +530,11 @@ class ChatApp:
 
         If there are unread messages, navigates to the unread messages 
         page. Otherwise, directs the user to the read messages result page.
+        Uses the count kept current by the long-poll, and only asks the server when it is not known yet.
         """
-        unread_messages = self.client.get_unread()
-        num_unread = len(unread_messages)
+        num_unread = self.unread_count
+        if num_unread < 0:
+            num_unread = len(self.client.get_unread())
         if num_unread > 0:
             self.setup_unread_messages_page()
         else:
@@ -415,13 +546,14 @@ class ChatApp:
 
         Ask users to enter the number of messages to read. 
         """
-        self.clear_window()
-        self.root.title("Read messages")
-        tk.Label(self.root, text="How many messages would you like to read? (Please enter an integer)").pack()
-        self.per_page_entry = tk.Entry(self.root)
-        self.per_page_entry.pack()
-        tk.Button(self.root, text="Read", command=self.setup_unread_messages_result_page).pack()
-        tk.Button(self.root, text="Back", command=self.setup_account_page).pack()
+        page, created = self.show_page("unread", "Read messages")
+        if created:
+            tk.Label(page, text="How many messages would you like to read? (Please enter an integer)").pack()
+            self.per_page_entry = tk.Entry(page)
+            self.per_page_entry.pack()
+            tk.Button(page, text="Read", command=self.setup_unread_messages_result_page).pack()
+            tk.Button(page, text="Back", command=self.setup_account_page).pack()
+        self.per_page_entry.delete(0, "end")
 
     def setup_unread_messages_result_page(self):
         """
@@ -444,38 +576,49 @@ class ChatApp:
         """
         Displays read messages with a delete option. Add a scroll bar to display all messages comfortably. 
 
-        Each message is a button that allows deletion upon clicking. 
+        Each message is a line that allows deletion upon clicking. 
         """
         self.clear_window()
         self.root.title("Read Messages")
         tk.Label(self.root, text="(Click on a message to delete.)", fg="gray").pack()
 
-        # add scroll bar
-        main_frame = tk.Frame(self.root)
-        main_frame.pack(fill="both", expand=True)
-        canvas = tk.Canvas(main_frame)
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar = tk.Scrollbar(main_frame, orient="vertical", command=canvas.yview)
-        scrollbar.pack(side="right", fill="y")
-        message_frame = tk.Frame(canvas)
-        canvas.create_window((0, 0), window=message_frame, anchor="n", width=self.root.winfo_width())
-        canvas.configure(yscrollcommand=scrollbar.set)
-
         messages = self.client.read_messages()
-        idx = len(messages) - 1
-        for message in messages[::-1]:
-            sender = message['from']
-            me = message['message']
-
-            # each message is a button that allows deletion upon clicking
-            msg_button = tk.Button(message_frame, text=f"{sender}: {me}",command=lambda s=sender, m=me, i=idx: self.confirm_delete_message(s, m, i))
-            msg_button.pack(fill="x", padx=10, pady=2) 
-            idx -= 1
-        message_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        canvas.bind_all("<MouseWheel>", lambda e: canvas.yview_scroll(-1 * (e.delta // 120), "units"))
+        lines = [f"{message['from']}: {message['message']}" for message in messages[::-1]] # newest message first
+        text = self.setup_text_list(lines)
+
+        # each line is clickable and allows deletion of its message
+        def on_click(event):
+            line = int(text.index(f"@{event.x},{event.y}").split(".")[0]) # Text lines are numbered from 1
+            if line <= len(messages):
+                idx = len(messages) - line
+                self.confirm_delete_message(messages[idx]['from'], messages[idx]['message'], idx)
+        text.config(cursor="hand2")
+        text.bind("<Button-1>", on_click)
         tk.Button(self.root, text="Back", command=self.setup_account_page).pack()
 
     
+    def setup_text_list(self, lines):
+        """
+        Displays lines in a single read-only Text widget with a scroll bar, instead of one widget per line.
+
+        Args:
+            lines (list): The lines to display, each a string.
+
+        Returns:
+            tk.Text: The Text widget holding the lines.
+        """
+        main_frame = tk.Frame(self.root)
+        main_frame.pack(fill="both", expand=True)
+        scrollbar = tk.Scrollbar(main_frame, orient="vertical")
+        scrollbar.pack(side="right", fill="y")
+        text = tk.Text(main_frame, wrap="none", yscrollcommand=scrollbar.set)
+        text.pack(side="left", fill="both", expand=True)
+        scrollbar.config(command=text.yview)
+        text.tag_configure("center", justify="center")
+        text.insert("end", "\n".join(line.replace("\n", " ") for line in lines), "center") # keep one line per entry
+        text.config(state="disabled")
+        return text
+
     def confirm_delete_message(self, sender, message, idx):
         """
         Confirms the deletion of a message.
@@ -528,12 +671,37 @@ class ChatApp:
         tk.Button(confirm_window, text="No", command=confirm_window.destroy).pack(side=tk.RIGHT, padx=10)
 
 
+    def show_page(self, name, title):
+        """
+        Shows a cached page, hiding whatever is currently displayed. Each page is built once and reused on later visits.
+
+        Args:
+            name (str): The name of the page.
+            title (str): The window title for the page.
+
+        Returns:
+            tuple: The page frame, and True if it was just created and still needs its widgets.
+        """
+        self.clear_window()
+        self.root.title(title)
+        created = name not in self.pages
+        if created:
+            self.pages[name] = tk.Frame(self.root)
+        self.pages[name].pack(fill="both", expand=True)
+        self.current_page = name
+        return self.pages[name], created
+
     def clear_window(self):
         """
-        Clears all widgets from the current window.
+        Clears the current window. Cached pages are hidden, any other widgets are destroyed.
         """
+        self.current_page = None
+        pages = set(self.pages.values())
         for widget in self.root.winfo_children():
-            widget.destroy()
+            if widget in pages:
+                widget.pack_forget()
+            else:
+                widget.destroy()
 
 if __name__ == "__main__":
     import configparser
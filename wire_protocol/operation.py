@@ -1,18 +1,20 @@
-class Operations:
+from enum import IntEnum
+
+class Operations(IntEnum):
   """
-    Defines operation codes used in the communication protocol.
+    Defines operation codes used in the communication protocol. Each code is sent as a single byte.
 
   """
   
-  SUCCESS = "00"
-  FAILURE = "01"
+  SUCCESS = 0
+  FAILURE = 1
 
-  SEND_MESSAGE = "10"
-  READ_UNREAD = "11"
-  READ_ALL = "12"
-  COUNT_UNREAD = "13" 
-  LOGIN = "14"
-  READ_ALL = "15"
-  LIST_ACCOUNTS = "16"
-  DELETE_MESSAGE = "17"
-  DELETE_ACCOUNT = "18"
+  SEND_MESSAGE = 10
+  READ_UNREAD = 11
+  READ_ALL = 12
+  COUNT_UNREAD = 13 
+  LOGIN = 14
+  LIST_ACCOUNTS = 16
+  DELETE_MESSAGE = 17
+  DELETE_ACCOUNT = 18
+  WAIT_UNREAD = 19
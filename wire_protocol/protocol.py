@@ -1,20 +1,87 @@
+import struct
+from dataclasses import dataclass
+from operation import Operations
+
+FIELD_LEN = struct.Struct('!I') # big-endian unsigned 32-bit integer used for field counts and lengths
+OPERATION = struct.Struct('!B') # operation code, a single unsigned byte
+ACK_LEN = OPERATION.size # an ack frame carries only the status code, shorter than any serialized message
+COMPRESSED = 0x80000000 # top bit of the length header, set when the message is zlib-compressed
+COMPRESS_THRESHOLD = 1024 # messages longer than this many bytes are compressed before sending
+
+# encoded forms of the constant parts of a message, built once instead of on every send
+OP_BYTES = {op: OPERATION.pack(op) for op in Operations}
+ACK_FRAMES = {op: FIELD_LEN.pack(ACK_LEN) + OP_BYTES[op] for op in Operations} # complete ack frames, length header included
+VERSION_BYTES = {} # protocol version -> encoded byte, filled on first use
+
+@dataclass(slots=True)
+class Request:
+  """
+  A deserialized request. Slots make it cheaper to build than the dictionary returned by deserialize,
+  and its fields are read as attributes instead of looked up by key.
+
+  Attributes:
+      version (str): The protocol version.
+      operation (Operations): The operation code.
+      info (list): The fields that were sent, each a string.
+  """
+  version: str
+  operation: Operations
+  info: list
+
 def serialize(data):
   """
   Serializes a dictionary containing protocol data into a byte string.
 
+  The body is the version byte, the one-byte operation code, a field count,
+  and then each field as a length followed by its UTF-8 bytes.
+
   Args:
       data (dict): A dictionary with the following keys:
           - 'version' (str): The protocol version.
-          - 'operation' (str): A two-character operation code.
-          - 'info' (str): The message to be sent.
+          - 'operation' (Operations): The operation code.
+          - 'info' (list): The fields to be sent, each a string.
 
   Returns:
       bytes: A serialized byte string containing the encoded data.
   """
-  encode_data = data["version"].encode("utf-8")
-  encode_data += data["operation"].encode("utf-8")
-  encode_data += data["info"].encode("utf-8")
-  return encode_data
+  version = VERSION_BYTES.get(data["version"])
+  if version is None:
+    version = VERSION_BYTES[data["version"]] = data["version"].encode("utf-8")
+  fields = data["info"]
+  parts = [version, OP_BYTES[data["operation"]], FIELD_LEN.pack(len(fields))]
+  for field in fields:
+    encoded = field.encode("utf-8")
+    parts.append(FIELD_LEN.pack(len(encoded)))
+    parts.append(encoded)
+  return b"".join(parts)
+
+def serialize_into(data, buffer):
+  """
+  Serializes protocol data into a reusable buffer as a complete frame, preceded by its 4-byte length header.
+
+  Args:
+      data (dict): A dictionary with the same keys as for serialize.
+      buffer (bytearray): The scratch buffer to write into, grown if the frame does not fit.
+
+  Returns:
+      int: The length of the frame written at the start of the buffer.
+  """
+  fields = [field.encode("utf-8") for field in data["info"]]
+  size = 2 * FIELD_LEN.size + 2 + sum(FIELD_LEN.size + len(field) for field in fields) # header, version, operation, count, fields
+  if size > len(buffer):
+    buffer.extend(bytes(size - len(buffer)))
+
+  FIELD_LEN.pack_into(buffer, 0, size - FIELD_LEN.size)
+  buffer[4] = ord(data["version"])
+  buffer[5] = data["operation"]
+  FIELD_LEN.pack_into(buffer, 6, len(fields))
+  offset = 6 + FIELD_LEN.size
+  for field in fields:
+    FIELD_LEN.pack_into(buffer, offset, len(field))
+    offset += FIELD_LEN.size
+    buffer[offset:offset + len(field)] = field
+    offset += len(field)
+  return size
 
 def deserialize(data):
   """
@@ -26,13 +93,88 @@ def deserialize(data):
   Returns:
       dict: A dictionary with the following keys:
           - 'version' (str): The protocol version.
-          - 'operation' (str): A two-character operation code.
-          - 'info' (str): The message to be sent.
+          - 'operation' (Operations): The operation code.
+          - 'info' (list): The fields that were sent, each a string.
   """
-  data = data.decode("utf-8")
+  data = memoryview(data)
   decod_data = {}
-  decod_data["version"] = data[0]
-  decod_data["operation"] = data[1:3]
-  decod_data["info"] = data[3:]
+  decod_data["version"] = bytes(data[0:1]).decode("utf-8")
+  decod_data["operation"] = Operations(data[1])
+  decod_data["info"] = unpack_fields(data)
 
   return decod_data
+
+def deserialize_request(data):
+  """
+  Deserializes a byte string into a Request, without building a dictionary.
+
+  Args:
+      data (bytes): The serialized byte string to be decoded.
+
+  Returns:
+      Request: The version, operation and fields of the message.
+  """
+  data = memoryview(data)
+  return Request(bytes(data[0:1]).decode("utf-8"), Operations(data[1]), unpack_fields(data))
+
+def unpack_fields(data):
+  """
+  Decodes the fields of a serialized message, which follow the version and operation bytes.
+
+  Args:
+      data (memoryview): The serialized message.
+
+  Returns:
+      list: The fields that were sent, each a string.
+  """
+  count = FIELD_LEN.unpack_from(data, 2)[0]
+  offset = 2 + FIELD_LEN.size
+  fields = []
+  for _ in range(count):
+    length = FIELD_LEN.unpack_from(data, offset)[0]
+    offset += FIELD_LEN.size
+    fields.append(str(data[offset:offset + length], "utf-8"))
+    offset += length
+  return fields
+
+def encode_message(msg):
+  """
+  Encodes a message as its two protocol fields, the sender and the message, each preceded by its length.
+
+  Args:
+      msg (dict): A message with 'from' and 'message' keys.
+
+  Returns:
+      bytes: The encoded fields, ready to be joined into a serialized message list.
+  """
+  sender = msg["from"].encode("utf-8")
+  message = msg["message"].encode("utf-8")
+  return b"".join([FIELD_LEN.pack(len(sender)), sender, FIELD_LEN.pack(len(message)), message])
+
+def serialize_messages(data, encoded):
+  """
+  Serializes a reply carrying a list of messages from their already encoded fields.
+
+  Args:
+      data (dict): A dictionary with the 'version' and 'operation' keys, as for serialize.
+      encoded (list): The fields of each message, as returned by encode_message.
+
+  Returns:
+      bytes: A serialized byte string, the same as serialize would give for the alternating sender and message fields.
+  """
+  version = VERSION_BYTES.get(data["version"])
+  if version is None:
+    version = VERSION_BYTES[data["version"]] = data["version"].encode("utf-8")
+  return b"".join([version, OP_BYTES[data["operation"]], FIELD_LEN.pack(2 * len(encoded)), *encoded])
+
+def unpack_messages(fields):
+  """
+  Rebuilds a list of messages from protocol fields.
+
+  Args:
+      fields (list): Alternating sender and message fields.
+
+  Returns:
+      list: Messages, each a dictionary with 'from' and 'message' keys.
+  """
+  return [{"from": sender, "message": message} for sender, message in zip(fields[0::2], fields[1::2])]
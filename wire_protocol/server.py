@@ -1,19 +1,111 @@
+import hashlib
+import hmac
+import itertools
+import mmap
 import socket
+import selectors
 import threading
-import json # only use json for data storage
+import traceback
+import orjson # only use json for data storage
 import os
-from protocol import serialize, deserialize
+import queue
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from protocol import serialize, serialize_messages, encode_message, deserialize_request, FIELD_LEN, ACK_FRAMES, COMPRESSED, COMPRESS_THRESHOLD
 from operation import Operations
 
 USER_DATA_FILE = "accounts.json"
+USER_LOG_FILE = "accounts.log" # append-only log of mutations since the last snapshot
+SNAPSHOT_INTERVAL = 5 # seconds between snapshots of the accounts to USER_DATA_FILE
+LOG_BATCH_SIZE = 256 # most log records the log writer writes and fsyncs together
+LOG_MAP_SIZE = 1 << 22 # bytes the log file is preallocated to and mapped into memory, doubled whenever it fills up
+PASSWORD_DIGEST_SIZE = 8 # bytes of the blake2b digest stored for each password
+MAX_WORKERS = max(32, (os.cpu_count() or 1) * 4) # number of requests handled at the same time
+
+
+class RWLock:
+    """
+    A reader-writer lock that can be held by many readers or by a single writer.
+    
+    Waiting writers block new readers, so a steady stream of readers cannot starve a writer.
+    """
+    def __init__(self):
+        """
+        Initializes the RWLock instance.
+        """
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """
+        Holds the lock in shared mode.
+        """
+        with self.cond:
+            while self.writing or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """
+        Holds the lock in exclusive mode.
+        """
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+
+class Connection:
+    """
+    The state of a client connection served by the event loop.
+    """
+    def __init__(self, client, buffer):
+        """
+        Initializes the connection.
+        
+        Args:
+            client (socket): The client socket.
+            buffer (bytearray): The receive buffer of the connection, taken from the pool.
+        """
+        self.client = client
+        self.buffer = buffer
+        self.start = self.end = 0 # the unread bytes are buffer[start:end]
+        self.requests = deque() # complete requests not handled yet, in the order they arrived
+        self.lock = threading.Lock() # guards requests, busy and closed
+        self.busy = False # set while a worker handles the requests or a WAIT_UNREAD is waiting, so replies keep their order
+        self.closed = False # set once the client closed the connection
 
 
 class Server:
     """
     A multi-client chat server using a custom wire protocol over sockets.
     """
-    HEADER = 64 # size of message that indicates the next message size
+    HEADER = 4 # size of message that indicates the next message size, a big-endian unsigned 32-bit integer
     VERSION = "1" # protocal version number
+    WAIT_TIMEOUT = 30 # longest time in seconds a WAIT_UNREAD request is held before answering
+    RECV_SIZE = 65536 # most bytes asked for by a single recv
 
     def __init__(self, host='0.0.0.0', port=5555):
         """
@@ -28,193 +120,922 @@ class Server:
         self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server.bind((self.host, self.port))
         self.server.listen()
-        self.accounts = self.load_accounts()
-        self.lock = threading.Lock()
+        # every request holds the global lock in shared mode plus the locks of the users it touches,
+        # so requests for different users run in parallel; account deletion and snapshots hold it exclusively
+        self.lock = RWLock()
+        self.user_locks = {}
+        self.locks_guard = threading.Lock() # guards the creation of user locks
+        self.pending_lock = threading.Lock() # guards the count of pending log records
+        self.directory_lock = threading.Lock() # guards accounts_lower
+        self.buffer_pool = queue.LifoQueue() # receive buffers of closed connections, reused by new ones
+        # frames of the replies that never change, built once and sent without a dict or serialize
+        self.success_frame = self.frame({'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': []})
+        self.failure_frame = self.frame({'version': self.VERSION, 'operation': Operations.FAILURE, 'info': []})
+        self.signup_frame = self.frame({'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': ['0']})
+        self.sent_frame = self.frame({'version': self.VERSION, 'operation': Operations.SUCCESS, 
+                                      'info': ['Send message successfully.']})
+        self.invalid_recipient_frame = self.frame({'version': self.VERSION, 'operation': Operations.FAILURE, 
+                                                   'info': ['Invalid recipient. Please enter a valid username.']})
+        self.waiters = {} # username -> WAIT_UNREAD requests waiting on that user's unread messages
+        self.waiters_lock = threading.Lock() # guards waiters
+        self.handlers = {
+            Operations.LOGIN: self.handle_login,
+            Operations.SEND_MESSAGE: self.handle_send,
+            Operations.READ_UNREAD: self.handle_read_unread,
+            Operations.READ_ALL: self.handle_read_all,
+            Operations.COUNT_UNREAD: self.handle_count_unread,
+            Operations.LIST_ACCOUNTS: self.handle_list,
+            Operations.DELETE_MESSAGE: self.handle_delete_message,
+            Operations.DELETE_ACCOUNT: self.handle_delete_account,
+            Operations.WAIT_UNREAD: self.handle_wait_unread,
+        }
+        self.replay = {
+            'create_account': self.create_account,
+            'store_message': self.store_message,
+            'mark_read': self.mark_read,
+            'remove_message': self.remove_message,
+            'remove_account': self.remove_account,
+        }
+        self.accounts = self.load_accounts() # also builds the sent_by index and sets generation
+        self.pending = self.replay_log() # number of logged mutations not yet included in a snapshot
+        self.open_log()
+        if not self.pending: # the log is missing, empty or already in the snapshot
+            self.start_log()
+        self.log_queue = queue.Queue() # records waiting for the log writer, with their generation and done event
+        self.log_lock = threading.Lock() # held while writing to or truncating the log file
+        threading.Thread(target=self.log_writer, daemon=True).start()
+        threading.Thread(target=self.snapshot_loop, daemon=True).start()
+        # one thread waits on every connection and hands complete requests to a fixed set of workers
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="chat")
     
+    @property
+    def accounts(self):
+        """
+        dict: The user accounts, keyed by username.
+        """
+        return self.account_data
+
+    @accounts.setter
+    def accounts(self, accounts):
+        for account in accounts.values():
+            account['unread_messages'] = deque(account['unread_messages']) # read in order with popleft
+        self.account_data = accounts
+        self.index_messages()
+        # id(msg) -> (msg, the encoded fields of msg), so a message is encoded once however often it is read;
+        # holding msg keeps its id from being reused while the entry exists
+        self.encoded = {}
+        with self.directory_lock:
+            # the lowercased form of every username, used to search accounts
+            self.accounts_lower = {username: username.lower() for username in accounts}
+
+    def index_messages(self):
+        """
+        Builds the sent_by index, which maps each sender to the messages they sent, so that deleting an
+        account only visits the recipients of its messages. Messages are keyed by object identity, since
+        the same message object moves from the unread to the read messages of its recipient.
+        """
+        self.sent_by = {}
+        for user, account in self.account_data.items():
+            for msg in itertools.chain(account['unread_messages'], account['read_messages']):
+                self.sent_by.setdefault(msg['from'], {})[id(msg)] = (user, msg)
+
     # Load accounts from JSON
     def load_accounts(self):
         """
-        Loads user accounts from a JSON file.
+        Loads user accounts from a JSON file, and sets generation to the generation of the snapshot.
         
         Returns:
             dict: A dictionary containing user accounts.
         """
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, "r") as file:
-                return json.load(file)
-        return {}
+        # incremented by each snapshot and saved with it, records from older generations are already in the snapshot
+        self.generation = 0
+        if not os.path.exists(USER_DATA_FILE):
+            return {}
+        with open(USER_DATA_FILE, "rb") as file:
+            accounts = orjson.loads(file.read())
+        if isinstance(accounts.get('generation'), int): # a snapshot saved with its generation, not a bare accounts dict
+            self.generation = accounts['generation']
+            accounts = accounts['accounts']
+        return accounts
+
+    def replay_log(self):
+        """
+        Re-applies the mutations recorded in the log file on top of the loaded snapshot, and sets log_offset to 
+        the end of the last complete record. The preallocated rest of the file holds zero bytes.
+        
+        The log starts with the generation of the snapshot it follows. A log from an older generation is already 
+        included in the snapshot, since a crash stopped the snapshot after saving the accounts and before clearing 
+        the log, so it is not replayed.
+        
+        Every record ends with a newline, so only the bytes after the last one can be torn by a crash; open_log 
+        clears them. Any complete record that cannot be read or applied is an error, and the server does not start.
+        
+        Returns:
+            int: The number of records replayed.
+        """
+        self.log_offset = 0
+        if not os.path.exists(USER_LOG_FILE):
+            return 0
+        with open(USER_LOG_FILE, "rb") as file:
+            data = file.read()
+        end = data.find(b"\0")
+        if end != -1:
+            data = data[:end]
+        self.log_offset = data.rfind(b"\n") + 1 # new records overwrite a torn last line
+        records = [orjson.loads(line) for line in data[:self.log_offset].splitlines()]
+        log_generation = 0 # a log written before logs had a generation
+        if records and 'op' not in records[0]:
+            log_generation = records.pop(0)['generation']
+        if log_generation != self.generation:
+            return 0
+        for record in records:
+            self.replay[record['op']](**record['args'])
+        return len(records)
+
+    def open_log(self):
+        """
+        Maps the log file into memory, so appending a record is a copy into the page cache instead of a write call.
+        """
+        fd = os.open(USER_LOG_FILE, os.O_RDWR | os.O_CREAT)
+        try:
+            size = max(os.fstat(fd).st_size, LOG_MAP_SIZE)
+            os.ftruncate(fd, size) # preallocate, the unwritten part reads as zero bytes
+            self.log_map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd) # the map keeps its own handle on the file
+        # cut off a torn last line, so no part of it is left after the records written over it
+        end = self.log_map.find(b"\0", self.log_offset)
+        if end == -1:
+            end = len(self.log_map)
+        self.log_map[self.log_offset:end] = bytes(end - self.log_offset)
+
+    def start_log(self):
+        """
+        Clears the log in place and writes the current generation at its start, so a later replay can tell whether 
+        the records that follow are already included in the snapshot. Must be called while holding log_lock, or 
+        before the log writer starts.
+        """
+        header = orjson.dumps({'generation': self.generation}, option=orjson.OPT_APPEND_NEWLINE)
+        # the file keeps its preallocated size, the cleared part reads as zero bytes again
+        self.log_map[:self.log_offset] = bytes(self.log_offset)
+        self.log_map[:len(header)] = header
+        self.log_map.flush()
+        self.log_offset = len(header)
 
     # Save accounts to JSON
     def save_accounts(self, accounts):
         """
         Saves user accounts to a JSON file.
         
+        The data is written to a temporary file first and then renamed, so a crash never leaves a partial snapshot.
+        The current generation is saved with the accounts.
+        
         Args:
             accounts (dict): The accounts data to save.
         """
-        with open(USER_DATA_FILE, "w") as file:
-            json.dump(accounts, file, indent=4)
+        tmp_file = USER_DATA_FILE + ".tmp"
+        snapshot = {'generation': self.generation, 'accounts': accounts}
+        with open(tmp_file, "wb") as file:
+            file.write(orjson.dumps(snapshot, default=list)) # deques are saved as lists
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, USER_DATA_FILE)
+
+    def append_log(self, op, **args):
+        """
+        Queues a mutation record for the log writer. Must be called while holding the locks of the mutated accounts, 
+        so that the records of each account are logged in the order its mutations were applied.
+        
+        Args:
+            op (str): The name of the mutation, used to look up its replay function.
+            **args: The arguments of the mutation.
+        
+        Returns:
+            threading.Event: Set once the record is on disk or covered by a snapshot.
+        """
+        done = threading.Event()
+        record = orjson.dumps({'op': op, 'args': args}) + b"\n"
+        self.log_queue.put((record, self.generation, done))
+        with self.pending_lock:
+            self.pending += 1
+        return done
+
+    def log_writer(self):
+        """
+        Writes queued log records in a background thread. Records queued by other clients while a batch is 
+        being written are grouped into the next batch, which takes a single write and a single fsync.
+        """
+        while True:
+            batch = [self.log_queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.log_lock:
+                records = b"".join([record for record, generation, _ in batch if generation == self.generation]) # skip records already in a snapshot
+                if records:
+                    end = self.log_offset + len(records)
+                    if end > len(self.log_map):
+                        self.log_map.resize(max(end, 2 * len(self.log_map)))
+                    self.log_map[self.log_offset:end] = records
+                    # write the dirty pages to disk, flush needs an offset on a page boundary
+                    start = self.log_offset - self.log_offset % mmap.ALLOCATIONGRANULARITY
+                    self.log_map.flush(start, end - start)
+                    self.log_offset = end
+            for _, _, done in batch:
+                done.set()
+
+    def snapshot(self):
+        """
+        Writes the accounts to the JSON file and clears the log if there are pending mutations.
+        """
+        with self.lock.write():
+            if not self.pending:
+                return
+            with self.log_lock:
+                self.generation += 1 # the snapshot includes every record logged so far
+                try:
+                    self.save_accounts(self.accounts)
+                except Exception:
+                    self.generation -= 1 # the log writer must not skip records that are in no snapshot
+                    raise
+                self.start_log()
+            self.pending = 0
+
+    def snapshot_loop(self):
+        """
+        Periodically snapshots the accounts in a background thread. A failed snapshot, such as one that runs out of
+        disk space, is reported and tried again at the next interval, since its mutations are still pending.
+        """
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.snapshot()
+            except Exception:
+                traceback.print_exc()
+
+    def lock_for(self, username):
+        """
+        Returns the lock of a user, creating it on first use.
+        
+        Args:
+            username (str): The username of the account.
+        
+        Returns:
+            threading.Lock: The lock of the user.
+        """
+        lock = self.user_locks.get(username)
+        if lock is None:
+            with self.locks_guard:
+                lock = self.user_locks.setdefault(username, threading.Lock())
+        return lock
+
+    @contextmanager
+    def locked(self, *usernames):
+        """
+        Holds the global lock in shared mode and the locks of the given users.
+        
+        User locks are always taken in sorted order, so two requests can never wait on each other.
+        
+        Args:
+            *usernames (str): The usernames of the accounts the request touches.
+        """
+        with self.lock.read(), ExitStack() as stack:
+            for username in sorted(set(usernames)):
+                stack.enter_context(self.lock_for(username))
+            yield
+
+    def hash_password(self, password, salt):
+        """
+        Hashes a password with the salt of its account.
+        
+        Args:
+            password (str): The password sent by the client.
+            salt (bytes): The salt of the account.
+        
+        Returns:
+            bytes: The blake2b digest of the password.
+        """
+        return hashlib.blake2b(password.encode('utf-8'), digest_size=PASSWORD_DIGEST_SIZE, salt=salt).digest()
+
+    def check_password(self, account, password):
+        """
+        Checks a password against the one stored in an account.
+        
+        Args:
+            account (dict): The account.
+            password (str): The password sent by the client.
+        
+        Returns:
+            bool: True if the password is correct, False otherwise.
+        """
+        if 'pwhash' not in account: # account stored before passwords were hashed by the server
+            return hmac.compare_digest(account['password'].encode('utf-8'), password.encode('utf-8'))
+        pwhash = self.hash_password(password, bytes.fromhex(account['salt']))
+        return hmac.compare_digest(bytes.fromhex(account['pwhash']), pwhash)
+
+    def create_account(self, username, salt, pwhash):
+        """
+        Creates a new account with no messages.
+        
+        Args:
+            username (str): The username of the new account.
+            salt (str): The hex-encoded salt of the new account.
+            pwhash (str): The hex-encoded password hash of the new account.
+        """
+        self.accounts[username] = {'salt': salt, 'pwhash': pwhash, 'read_messages': [], 'unread_messages': deque()}
+        with self.directory_lock:
+            self.accounts_lower[username] = username.lower()
+
+    def store_message(self, sender, recipient, message):
+        """
+        Adds a message to the recipient's undelivered messages.
+        
+        Args:
+            sender (str): The username of the sender.
+            recipient (str): The username of the recipient.
+            message (str): The message content.
+        """
+        msg = {"from": sender, "message": message}
+        self.accounts[recipient]['unread_messages'].append(msg)
+        self.encoded[id(msg)] = (msg, encode_message(msg))
+        self.sent_by.setdefault(sender, {})[id(msg)] = (recipient, msg)
+
+    def mark_read(self, username, per_page):
+        """
+        Moves the oldest unread messages of a user to the user's read messages.
+        
+        Args:
+            username (str): The username of the account.
+            per_page (int): The number of messages to move.
+        
+        Returns:
+            list: The messages that were moved.
+        """
+        unread = self.accounts[username]['unread_messages']
+        unread_messages = [unread.popleft() for _ in range(min(per_page, len(unread)))]
+        self.accounts[username]['read_messages'].extend(unread_messages)
+        return unread_messages
+
+    def remove_message(self, username, idx):
+        """
+        Deletes a read message of a user.
+        
+        Args:
+            username (str): The username of the account.
+            idx (int): The index of the message in the user's read messages.
+        """
+        msg = self.accounts[username]["read_messages"].pop(idx)
+        self.sent_by.get(msg['from'], {}).pop(id(msg), None)
+        self.encoded.pop(id(msg), None)
+
+    def remove_account(self, username):
+        """
+        Deletes an account and all messages sent from it, so that the recipients will no longer see these messages.
+        
+        Args:
+            username (str): The username of the account to delete.
+        """
+        # only the recipients of this user's messages need to be filtered
+        sent_ids = {}
+        for msg_id, (recipient, _) in self.sent_by.pop(username, {}).items():
+            sent_ids.setdefault(recipient, set()).add(msg_id)
+        for recipient, msg_ids in sent_ids.items():
+            account = self.accounts.get(recipient)
+            if account is None:
+                continue
+            account['unread_messages'] = deque(msg for msg in account['unread_messages'] if id(msg) not in msg_ids)
+            account['read_messages'] = [msg for msg in account['read_messages'] if id(msg) not in msg_ids]
+            for msg_id in msg_ids:
+                self.encoded.pop(msg_id, None)
+        # the messages this user received no longer need to be found by their senders
+        account = self.accounts.pop(username) # delete account
+        with self.directory_lock:
+            del self.accounts_lower[username]
+        for msg in itertools.chain(account['unread_messages'], account['read_messages']):
+            self.sent_by.get(msg['from'], {}).pop(id(msg), None)
+            self.encoded.pop(id(msg), None)
     
-    def package_send(self, send_data, client):
+    def wait_unread(self, conn, username, known_count):
         """
-        Serializes and sends data to the client.
+        Holds a WAIT_UNREAD request until the number of unread messages of a user differs from the count the client
+        is showing. The request does not hold a worker while it waits, it is answered by notify_unread or once
+        WAIT_TIMEOUT has passed.
         
         Args:
-            send_data (dict): The data to be sent.
+            conn (Connection): The connection of the request.
+            username (str): The username of the account.
+            known_count (int): The number of unread messages the client is already showing.
+        
+        Returns:
+            bool: True if the request was answered right away, False if it is waiting.
+        """
+        with self.locked(username):
+            # checked and registered under the user's lock, so a change cannot slip in between
+            if username in self.accounts and len(self.accounts[username]['unread_messages']) == known_count:
+                with self.waiters_lock:
+                    deadline = time.monotonic() + self.WAIT_TIMEOUT
+                    self.waiters.setdefault(username, []).append((conn, known_count, deadline))
+                return False
+        self.send_unread_count(username, conn.client)
+        return True
+
+    def notify_unread(self, username):
+        """
+        Answers the WAIT_UNREAD requests waiting on a user's unread messages whose count has changed.
+        
+        Args:
+            username (str): The username of the account.
+        """
+        with self.waiters_lock:
+            waiting = self.waiters.pop(username, None)
+            if not waiting:
+                return
+            account = self.accounts.get(username)
+            count = len(account['unread_messages']) if account else None
+            still_waiting = [waiter for waiter in waiting if waiter[1] == count]
+            if still_waiting:
+                self.waiters[username] = still_waiting
+        for conn, known_count, _ in waiting:
+            if known_count != count: # answered by a worker, so a slow client cannot hold up this request
+                self.pool.submit(self.finish_wait, conn, username)
+
+    def expire_waits(self):
+        """
+        Answers the WAIT_UNREAD requests that have waited for WAIT_TIMEOUT.
+        """
+        now = time.monotonic()
+        expired = []
+        with self.waiters_lock:
+            for username, waiting in list(self.waiters.items()):
+                if all(deadline > now for _, _, deadline in waiting):
+                    continue
+                expired.extend((conn, username) for conn, _, deadline in waiting if deadline <= now)
+                waiting = [waiter for waiter in waiting if waiter[2] > now]
+                if waiting:
+                    self.waiters[username] = waiting
+                else:
+                    del self.waiters[username]
+        for conn, username in expired:
+            self.pool.submit(self.finish_wait, conn, username)
+
+    def send_unread_count(self, username, client):
+        """
+        Sends the number of unread messages of a user, or a failure if the account no longer exists.
+        
+        Args:
+            username (str): The username of the account.
             client (socket): The client socket.
         """
-        serialized_data = serialize(send_data)
+        if username in self.accounts:
+            count = str(len(self.accounts[username]['unread_messages']))
+            send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': [count]}
+            self.package_send(send_data, client)
+        else:
+            self.send_frame(self.failure_frame, client)
+
+    def finish_wait(self, conn, username):
+        """
+        Answers a waiting WAIT_UNREAD request and goes on with the requests that arrived behind it.
+        
+        Args:
+            conn (Connection): The connection of the request.
+            username (str): The username of the account.
+        """
+        try:
+            self.send_unread_count(username, conn.client)
+        except OSError:
+            self.shutdown(conn)
+        self.serve(conn)
+
+    def message_fields(self, messages):
+        """
+        Gets the encoded fields of messages, encoding a message only if it was not encoded before. Must be called 
+        while holding the lock of the messages' recipient.
+        
+        Args:
+            messages (list): Messages, each a dictionary with 'from' and 'message' keys.
+        
+        Returns:
+            list: The encoded fields of each message, in order.
+        """
+        fields = []
+        for msg in messages:
+            entry = self.encoded.get(id(msg))
+            if entry is None: # loaded from disk and not read since
+                entry = self.encoded[id(msg)] = (msg, encode_message(msg))
+            fields.append(entry[1])
+        return fields
+
+    def frame(self, send_data):
+        """
+        Serializes data into the buffers of one frame. A reply without info becomes an ack frame holding only its 
+        status code, and a long reply is compressed with zlib and marked in its length header.
+        
+        Args:
+            send_data (dict): The data to be sent.
+        
+        Returns:
+            list: The buffers of the frame, either a whole ack frame or the length header and the message.
+        """
+        if not send_data['info']:
+            return [ACK_FRAMES[send_data['operation']]]
+        return self.frame_serialized(serialize(send_data))
+
+    def frame_messages(self, encoded):
+        """
+        Builds the frame of a successful reply carrying a list of messages.
+        
+        Args:
+            encoded (list): The encoded fields of each message, as returned by message_fields.
+        
+        Returns:
+            list: The buffers of the frame, as for frame.
+        """
+        if not encoded:
+            return [ACK_FRAMES[Operations.SUCCESS]]
+        send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS}
+        return self.frame_serialized(serialize_messages(send_data, encoded))
+
+    def frame_serialized(self, serialized_data):
+        """
+        Builds the frame of a serialized message, compressing it with zlib and marking its length header if it is long.
+        
+        Args:
+            serialized_data (bytes): The serialized message.
+        
+        Returns:
+            list: The length header and the message.
+        """
         msg_len = len(serialized_data)
-        send_len = str(msg_len).encode('utf-8')
-        send_len += b" " * (self.HEADER - len(send_len))
+        if msg_len > COMPRESS_THRESHOLD: # long message lists compress well, mostly repeated sender names
+            compressed_data = zlib.compress(serialized_data, 1)
+            if len(compressed_data) < msg_len:
+                serialized_data = compressed_data
+                msg_len = len(compressed_data) | COMPRESSED
+        send_len = FIELD_LEN.pack(msg_len) # precompiled, no format string lookup per reply
+        return [send_len, serialized_data]
 
-        client.send(send_len) # first send the length of message to be sent
-        client.send(serialized_data) 
+    def send_frame(self, frame, client):
+        """
+        Sends a frame built by frame to the client.
+        
+        Args:
+            frame (list): The buffers of the frame.
+            client (socket): The client socket.
+        """
+        if len(frame) == 1:
+            client.sendall(frame[0])
+            return
+        send_len, serialized_data = frame
+        if not hasattr(client, 'sendmsg'): # not available on Windows
+            client.sendall(send_len + serialized_data) # the length of message goes first, in the same write
+            return
+        # send the length and the message together in one syscall, without joining them into a new bytes object
+        sent = client.sendmsg(frame)
+        if sent < self.HEADER: # the kernel took only part of a large message, so send the rest
+            client.sendall(send_len[sent:])
+            sent = self.HEADER
+        if sent - self.HEADER < len(serialized_data):
+            client.sendall(memoryview(serialized_data)[sent - self.HEADER:])
 
-    def handle_client(self, client):
+    def package_send(self, send_data, client):
         """
-        Handles communication with a connected client.
+        Serializes and sends data to the client.
         
         Args:
+            send_data (dict): The data to be sent.
             client (socket): The client socket.
         """
-        connection_flag = True
-        while connection_flag:
-            msg_len = client.recv(self.HEADER).decode('utf-8') 
-            if not msg_len: # check if there is message
+        self.send_frame(self.frame(send_data), client)
+
+    def receive(self, conn):
+        """
+        Reads what a client has sent once the selector reports its socket readable. The recv_into fills as much of
+        the pooled buffer as is available, and every complete message in the buffer is queued for a worker.
+        
+        Args:
+            conn (Connection): The connection of the client.
+        """
+        buffer = conn.buffer
+        if conn.end == len(buffer): # no room left to receive into
+            if conn.start: # move the start of an incomplete message to the front
+                buffer[:conn.end - conn.start] = buffer[conn.start:conn.end]
+                conn.end -= conn.start
+                conn.start = 0
+            else: # a single message is larger than the buffer
+                buffer.extend(bytes(len(buffer)))
+        try:
+            with memoryview(buffer) as view:
+                received = conn.client.recv_into(view[conn.end:])
+        except OSError:
+            received = 0
+        if not received: # the client closed the connection
+            self.disconnect(conn)
+            return
+        conn.end += received
+        messages = []
+        while conn.end - conn.start >= self.HEADER:
+            msg_len = FIELD_LEN.unpack_from(buffer, conn.start)[0]
+            stop = conn.start + self.HEADER + msg_len
+            if conn.end < stop: # the rest of this message has not arrived yet
                 break
-            msg_len = int(msg_len)
-            deserialized_data = deserialize(client.recv(msg_len)) 
-
-            # Check version
-            recv_version = deserialized_data["version"]
-            if recv_version != self.VERSION:
-                print("Incorrect version.")
-                connection_flag = False
-            operation = deserialized_data["operation"]
-            info = deserialized_data["info"]
-
-            # Handle different operations
-            # Login
-            if operation == Operations.LOGIN: 
-                data = info.split('\n', 1)
-                username = data[0]
-                password = data[1]
-                if username in self.accounts: # check if account  exists
-                    if self.accounts[username]['password'] == password: # check if password correct
-                        send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': ''}
-                        self.package_send(send_data, client)
-                    else: 
-                        send_data = {'version': self.VERSION, 'operation': Operations.FAILURE, 'info': ''}
-                        self.package_send(send_data, client)
-                else: # if account does not exist, create new account
-                    self.accounts[username] = {'password': password, 'read_messages': [], 'unread_messages': []}
-                    self.save_accounts(self.accounts)
-                    send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': ''}
-                    self.package_send(send_data, client)
-
-            # Send a message
-            elif operation == Operations.SEND_MESSAGE:
-                data = info.split('\n', 2)
-                sender = data[0]
-                recipient = data[1]
-                send_message = data[2]
-                if recipient in self.accounts: # check if recipient is a valid account
-                    # save message to recipient's undelivered messages
-                    self.accounts[recipient]['unread_messages'].append({"from": sender, "message": send_message})
-                    self.save_accounts(self.accounts)
-                    message = 'Send message successfully.'
-                    send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': message}
-                    self.package_send(send_data, client)
-                else:
-                    message = 'Invalid recipient. Please enter a valid username.'
-                    send_data = {'version': self.VERSION, 'operation': Operations.FAILURE, 'info': message}
-                    self.package_send(send_data, client)
-         
-            # Read unread (undelivered) messaages
-            elif operation == Operations.READ_UNREAD:
-                data = info.split('\n', 1)
-                username = data[0]
-                per_page = int(data[1]) # the number of messages user wants to read
-                unread_messages = self.accounts[username]['unread_messages'][:per_page]
-
-                # move messages from unread messages to read messages
-                self.accounts[username]['read_messages'].extend(unread_messages)
-                self.accounts[username]['unread_messages'] = self.accounts[username]['unread_messages'][per_page:]
-                self.save_accounts(self.accounts)
-
-                message = "\n\t\n".join(f"{msg['from']} {msg['message']}" for msg in unread_messages)
-                send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': message}
-                self.package_send(send_data, client)
-
-            # Read all (delivered) messages
-            elif operation == Operations.READ_ALL:
-                username = info
-                read_messages = self.accounts[username]['read_messages']
-
-                message = "\n\t\n".join(f"{msg['from']} {msg['message']}" for msg in read_messages)
-                send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': message}
-                self.package_send(send_data, client)
-
-            # Count unread messages
-            elif operation == Operations.COUNT_UNREAD:
-                username = info
-                message = "\n\t\n".join(f"{msg['from']} {msg['message']}" for msg in self.accounts[username]['unread_messages'])
-                send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': message}
-                self.package_send(send_data, client)
-
-            # List accounts
-            elif operation == Operations.LIST_ACCOUNTS:
-                data = info.split('\n', 1)
-                query = data[1] # query for searching accounts
-                accounts = list(self.accounts.keys())
-                searched_accounts = [acc for acc in accounts if query in acc.lower()] # accounts that contain query
-
-                message = "\n".join(user for user in searched_accounts)
-                send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': message}
-                self.package_send(send_data, client)
-
-            # Delete message
-            elif operation == Operations.DELETE_MESSAGE:
-                data = info.split('\n', 1)
-                username = data[0]
-                idx = int(data[1]) # index of message the user wants to delete
-                del self.accounts[username]["read_messages"][idx] # delete message
-                self.save_accounts(self.accounts)
-
-                send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': ''}
-                self.package_send(send_data, client)
-
-            # Delete account
-            elif operation == Operations.DELETE_ACCOUNT:
-                username = info
-
-                # delete all messages sent from this accounts, so that the recipients will no longer see these messages
-                for user in self.accounts:
-                    i_un = len(self.accounts[user]['unread_messages'])-1
-                    for un_m in self.accounts[user]['unread_messages'][::-1]:
-                        if un_m['from'] == username:
-                            del self.accounts[user]['unread_messages'][i_un]
-                        i_un -= 1
-                    i_r = len(self.accounts[user]['read_messages'])-1
-                    for r_m in self.accounts[user]['read_messages'][::-1]:
-                        if r_m['from'] == username:
-                            del self.accounts[user]['read_messages'][i_r]
-                        i_r -= 1
-                del self.accounts[username] # delete account
-                self.save_accounts(self.accounts)
-
-                send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': ''}
-                self.package_send(send_data, client)
+            with memoryview(buffer) as view:
+                messages.append(bytes(view[conn.start + self.HEADER:stop])) # one copy, slicing the bytearray would make two
+            conn.start = stop
+        if conn.start == conn.end:
+            conn.start = conn.end = 0
+        if not messages:
+            return
+        with conn.lock:
+            conn.requests.extend(messages)
+            if conn.busy: # the worker already serving this connection will handle them in order
+                return
+            conn.busy = True
+        self.pool.submit(self.serve, conn)
 
-    def start(self):
+    def disconnect(self, conn):
+        """
+        Stops watching a connection the client has closed and returns its receive buffer to the pool. The socket is 
+        closed once no worker is using it any more.
+        
+        Args:
+            conn (Connection): The connection of the client.
+        """
+        self.selector.unregister(conn.client)
+        del conn.buffer[self.RECV_SIZE:] # drop any room grown for a large message
+        self.buffer_pool.put(conn.buffer)
+        conn.buffer = None
+        with conn.lock:
+            conn.closed = True
+            if conn.busy:
+                return
+        conn.client.close()
+
+    def shutdown(self, conn, how=socket.SHUT_RDWR):
+        """
+        Drops the pending requests of a connection and shuts its socket down, so the event loop disconnects it.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            how (int): Which directions to shut down, SHUT_RD still lets the current request be answered.
+        """
+        with conn.lock:
+            conn.requests.clear()
+        try:
+            conn.client.shutdown(how)
+        except OSError:
+            pass
+
+    def serve(self, conn):
         """
-        Starts the server and listens for incoming client connections.
+        Handles the queued requests of a connection one at a time in a worker thread, so its replies are sent in the
+        order of the requests.
+        
+        Args:
+            conn (Connection): The connection of the client.
         """
         while True:
+            with conn.lock:
+                if not conn.requests:
+                    conn.busy = False
+                    if conn.closed:
+                        conn.client.close()
+                    return
+                data = conn.requests.popleft()
+            try:
+                if not self.handle_request(conn, data):
+                    return # a WAIT_UNREAD is waiting, finish_wait goes on with the rest
+            except OSError: # the client went away while we replied
+                self.shutdown(conn)
+            except Exception:
+                traceback.print_exc()
+                self.shutdown(conn)
+
+    def handle_request(self, conn, data):
+        """
+        Handles a single request from a client.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            data (bytes): The request, without its length header.
+        
+        Returns:
+            bool: True if the request was answered, False if it waits to be answered later.
+        """
+        request = deserialize_request(data)
+
+        # Check version
+        if request.version != self.VERSION:
+            print("Incorrect version.")
+            self.shutdown(conn, socket.SHUT_RD) # answer this request, then end the connection
+        operation = request.operation
+        info = request.info
+
+        # look up the handler of the operation instead of comparing it against every operation in turn
+        handler = self.handlers.get(operation)
+        if handler is None:
+            self.send_frame(self.failure_frame, conn.client)
+            return True
+        return handler(conn, info) is not False # only handle_wait_unread leaves a request waiting
+
+    def handle_login(self, conn, info):
+        """
+        Logs a user in, creating the account if it does not exist.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        username, password = info
+        logged = None
+        with self.locked(username):
+            if username in self.accounts: # check if account  exists
+                if self.check_password(self.accounts[username], password): # check if password correct
+                    count = str(len(self.accounts[username]['unread_messages'])) # sent with the login result to save a round trip
+                    reply = self.frame({'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': [count]})
+                else: 
+                    reply = self.failure_frame
+            else: # if account does not exist, create new account
+                salt = os.urandom(hashlib.blake2b.SALT_SIZE)
+                pwhash = self.hash_password(password, salt).hex()
+                self.create_account(username, salt.hex(), pwhash)
+                logged = self.append_log('create_account', username=username, salt=salt.hex(), pwhash=pwhash)
+                reply = self.signup_frame
+        if logged:
+            logged.wait() # reply once the change is on disk
+        self.send_frame(reply, conn.client)
+
+    def handle_send(self, conn, info):
+        """
+        Stores a message for its recipient.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        sender, recipient, send_message = info
+        logged = None
+        with self.locked(sender, recipient):
+            if recipient in self.accounts: # check if recipient is a valid account
+                # save message to recipient's undelivered messages
+                self.store_message(sender, recipient, send_message)
+                logged = self.append_log('store_message', sender=sender, recipient=recipient, message=send_message)
+        if logged:
+            logged.wait() # reply once the change is on disk
+            self.notify_unread(recipient)
+            self.send_frame(self.sent_frame, conn.client)
+        else:
+            self.send_frame(self.invalid_recipient_frame, conn.client)
+
+    def handle_read_unread(self, conn, info):
+        """
+        Sends the oldest unread messages of a user and marks them as read.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        username = info[0]
+        per_page = int(info[1]) # the number of messages user wants to read
+        # move messages from unread messages to read messages
+        with self.locked(username):
+            unread_messages = self.message_fields(self.mark_read(username, per_page))
+            logged = self.append_log('mark_read', username=username, per_page=per_page)
+        logged.wait() # reply once the change is on disk
+        self.notify_unread(username)
+
+        self.send_frame(self.frame_messages(unread_messages), conn.client)
+
+    def handle_read_all(self, conn, info):
+        """
+        Sends the read messages of a user.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        username = info[0]
+        with self.locked(username):
+            read_messages = self.message_fields(self.accounts[username]['read_messages'])
+
+        self.send_frame(self.frame_messages(read_messages), conn.client)
+
+    def handle_count_unread(self, conn, info):
+        """
+        Sends the unread messages of a user, which the client counts.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        username = info[0]
+        with self.locked(username):
+            unread_messages = self.message_fields(self.accounts[username]['unread_messages'])
+        self.send_frame(self.frame_messages(unread_messages), conn.client)
+
+    def handle_list(self, conn, info):
+        """
+        Sends the usernames that contain a query.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        query = info[1] # query for searching accounts
+        with self.directory_lock:
+            searched_accounts = [acc for acc, acc_lower in self.accounts_lower.items() if query in acc_lower] # accounts that contain query
+
+        send_data = {'version': self.VERSION, 'operation': Operations.SUCCESS, 'info': searched_accounts}
+        self.package_send(send_data, conn.client)
+
+    def handle_delete_message(self, conn, info):
+        """
+        Deletes a read message of a user.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        username = info[0]
+        idx = int(info[1]) # index of message the user wants to delete
+        with self.locked(username):
+            self.remove_message(username, idx) # delete message
+            logged = self.append_log('remove_message', username=username, idx=idx)
+        logged.wait() # reply once the change is on disk
+
+        self.send_frame(self.success_frame, conn.client)
+
+    def handle_delete_account(self, conn, info):
+        """
+        Deletes an account and all messages sent from it.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        """
+        username = info[0]
+        # delete the account and all messages sent from it, which can touch any account
+        with self.lock.write():
+            self.remove_account(username)
+            logged = self.append_log('remove_account', username=username)
+        logged.wait() # reply once the change is on disk
+        for user in list(self.waiters): # unread messages from this account are gone, wake every waiter
+            self.notify_unread(user)
+
+        self.send_frame(self.success_frame, conn.client)
+
+    def handle_wait_unread(self, conn, info):
+        """
+        Sends the number of unread messages of a user once it differs from the count the client is showing.
+        
+        Args:
+            conn (Connection): The connection of the client.
+            info (list): The fields of the request.
+        
+        Returns:
+            bool: True if the request was answered, False if it waits to be answered later.
+        """
+        username = info[0]
+        known_count = int(info[1]) # the count the client is already showing
+        return self.wait_unread(conn, username, known_count)
+
+    def accept(self):
+        """
+        Accepts a waiting client connection and starts watching it for requests.
+        """
+        try:
             client, address = self.server.accept()
-            print(f"Connected with {str(address)}")
-            threading.Thread(target=self.handle_client, args=(client,)).start()
+        except BlockingIOError: # another connection attempt was given up
+            return
+        print(f"Connected with {str(address)}")
+        client.setblocking(True) # replies are sent by workers with sendall
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # send small responses right away
+        try:
+            buffer = self.buffer_pool.get_nowait()
+        except queue.Empty:
+            buffer = bytearray(self.RECV_SIZE)
+        self.selector.register(client, selectors.EVENT_READ, Connection(client, buffer))
+
+    def start(self):
+        """
+        Starts the server and runs the event loop, which accepts connections and reads requests from every client 
+        in one thread. Requests are handled by the worker pool.
+        """
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        next_expiry = time.monotonic() + 1
+        while True:
+            for key, _ in self.selector.select(timeout=1):
+                if key.data is None:
+                    self.accept()
+                else:
+                    self.receive(key.data)
+            if time.monotonic() >= next_expiry: # look for timed out WAIT_UNREAD requests about once a second
+                self.expire_waits()
+                next_expiry = time.monotonic() + 1
 
 if __name__ == "__main__":
     import configparser
@@ -3,6 +3,9 @@ import threading
 import time
 import socket
 import json
+import os
+import tempfile
+from unittest import mock
 import client
 import server
 
@@ -11,6 +14,12 @@ class TestClientServer(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Start the server in a separate thread before running any tests."""
+        # the tests inject accounts, so their records are logged to data files of their own
+        cls.data_dir = tempfile.TemporaryDirectory()
+        cls.data_files = [mock.patch.object(server, 'USER_DATA_FILE', os.path.join(cls.data_dir.name, 'accounts.json')),
+                          mock.patch.object(server, 'USER_LOG_FILE', os.path.join(cls.data_dir.name, 'accounts.log'))]
+        for patcher in cls.data_files:
+            patcher.start()
         # Establish server connection
         cls.server = server.Server(host='127.0.0.1', port=5555)
         cls.server_thread = threading.Thread(target=cls.server.start)
@@ -25,6 +34,10 @@ class TestClientServer(unittest.TestCase):
         """Clean up after all tests are done."""
         # Close the server socket (if needed)
         cls.server.server.close()
+        cls.server.pending = 0 # nothing left for the snapshot thread to write once the files are unpatched
+        for patcher in cls.data_files:
+            patcher.stop()
+        cls.data_dir.cleanup()
 
     def setUp(self):
         """Initialize the client for each test."""
@@ -63,6 +76,7 @@ class TestClientServer(unittest.TestCase):
         self.server.accounts = {'existing_user': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
         result = self.client.login('existing_user', 'hashed_password')
         self.assertTrue(result)
+        self.assertEqual(self.client.unread_count, 0)
 
     def test_login_new_user(self):
         """Test signing up a new user."""
@@ -99,6 +113,16 @@ class TestClientServer(unittest.TestCase):
         result = self.client.list_accounts('user2')
         self.assertEqual(result, ['user2'])
 
+    def test_pipelined_requests(self):
+        """Test that requests sent back to back without waiting are all answered in order."""
+        self.server.accounts = {'user1': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
+                                'user2': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
+        self.client.username = 'user1'
+        self.client.send_request(client.Operations.LIST_ACCOUNTS, ['user1', 'user1'])
+        self.client.send_request(client.Operations.LIST_ACCOUNTS, ['user1', 'user2'])
+        self.assertEqual(self.client.recv_response()['info'], ['user1'])
+        self.assertEqual(self.client.recv_response()['info'], ['user2'])
+
     def test_send_message_valid_recipient(self):
         """Test sending a message to a valid recipient."""
         self.server.accounts = {'sender': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
@@ -116,6 +140,16 @@ class TestClientServer(unittest.TestCase):
         self.assertEqual(status, False)
         self.assertEqual(result, 'Invalid recipient. Please enter a valid username.')
 
+    def test_send_long_message(self):
+        """Test sending a message larger than the client's send buffer and the server's receive buffer."""
+        self.server.accounts = {'sender': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
+                                'recipient': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
+        self.client.username = 'sender'
+        long_message = 'x' * 100000
+        status, result = self.client.send_message('recipient', long_message)
+        self.assertEqual(status, True)
+        self.assertEqual(list(self.server.accounts['recipient']['unread_messages']), [{'from': 'sender', 'message': long_message}])
+
     def test_read_unread_messages(self):
         """Test reading unread messages."""
         self.server.accounts = {'user': {'password':'123','unread_messages': [{'from': 'sender', 'message': 'Hello'}],
@@ -132,6 +166,30 @@ class TestClientServer(unittest.TestCase):
         result = self.client.read_messages()
         self.assertEqual(result, [{'from': 'sender', 'message': 'Hello'}])
 
+    def test_wait_unread_wakes_on_new_message(self):
+        """Test that a waiting unread count request returns when a message arrives."""
+        self.server.accounts = {'sender': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}, 
+                                'recipient': {'password': 'hashed_password', 'read_messages': [], 'unread_messages': []}}
+        waiter = client.Client(host='127.0.0.1', port=5555)
+        waiter.username = 'recipient'
+        result = []
+        wait_thread = threading.Thread(target=lambda: result.append(waiter.wait_unread(0)))
+        wait_thread.start()
+        time.sleep(0.1)
+        self.client.username = 'sender'
+        self.client.send_message('recipient', 'Hello')
+        wait_thread.join(5)
+        self.assertEqual(result, [1])
+
+    def test_read_many_messages(self):
+        """Test reading a message list long enough to be compressed by the server."""
+        messages = [{'from': 'sender', 'message': f'Hello {i}'} for i in range(500)]
+        self.server.accounts = {'user': {'password':'123', 'unread_messages': [],
+                                         'read_messages': list(messages)}}
+        self.client.username = 'user'
+        result = self.client.read_messages()
+        self.assertEqual(result, messages)
+
     def test_delete_message(self):
         """Test deleting a message."""
         self.server.accounts = {'user': {'password':'123', 'unread_messages': [],
@@ -149,7 +207,82 @@ class TestClientServer(unittest.TestCase):
         result = self.client.delete_account()
         self.assertEqual(result, 'Delete account successfully.')
         self.assertNotIn('user', self.server.accounts)
-        self.assertEqual(self.server.accounts['other_user']['unread_messages'], [])
+        self.assertEqual(list(self.server.accounts['other_user']['unread_messages']), [])
+
+    def test_delete_account_removes_sent_messages(self):
+        """Test that deleting an account removes its read and unread messages but keeps other senders' messages."""
+        self.server.accounts = {'user': {'password':'123', 'unread_messages': [], 'read_messages':[]}, 
+                                'other_user': {'password':'123', 
+                                               'read_messages': [{'from': 'user', 'message': 'Hi'}, {'from': 'friend', 'message': 'Hey'}], 
+                                               'unread_messages': [{'from': 'friend', 'message': 'Hello'}, {'from': 'user', 'message': 'Bye'}]}}
+        self.client.username = 'user'
+        self.client.send_message('other_user', 'Hello again')
+        result = self.client.delete_account()
+        self.assertEqual(result, 'Delete account successfully.')
+        self.assertEqual(self.server.accounts['other_user']['read_messages'], [{'from': 'friend', 'message': 'Hey'}])
+        self.assertEqual(list(self.server.accounts['other_user']['unread_messages']), [{'from': 'friend', 'message': 'Hello'}])
+
+    def test_failed_snapshot_keeps_generation(self):
+        """Test that a snapshot that fails to save leaves the generation, so pending records are still logged."""
+        generation = self.server.generation
+        with mock.patch.object(self.server, 'save_accounts', side_effect=OSError(28, 'No space left on device')):
+            self.server.append_log('mark_read', username='nobody', per_page=0).wait()
+            with self.assertRaises(OSError):
+                self.server.snapshot()
+        self.assertEqual(self.server.generation, generation)
+
+
+class TestLogRecovery(unittest.TestCase):
+    """Starts servers over the same snapshot and mapped log, kept in a temporary directory."""
+
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.data_dir.cleanup)
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(server, 'USER_DATA_FILE', os.path.join(self.data_dir.name, 'accounts.json')).start()
+        mock.patch.object(server, 'USER_LOG_FILE', os.path.join(self.data_dir.name, 'accounts.log')).start()
+
+    def restart(self):
+        """Start a server that recovers from the files; its handlers are called directly, so it never listens."""
+        chat_server = server.Server(host='127.0.0.1', port=0)
+        chat_server.server.close()
+        self.addCleanup(setattr, chat_server, 'pending', 0) # keep its snapshot thread off the unpatched files
+        return chat_server
+
+    def write_log(self, data):
+        """Write a log file as a crashed server left it, without the zero bytes of its preallocated tail."""
+        with open(server.USER_LOG_FILE, 'wb') as log_file:
+            log_file.write(data)
+
+    def test_restart_after_interrupted_snapshot(self):
+        """Test that a log already included in the snapshot is not replayed again."""
+        chat_server = self.restart()
+        chat_server.create_account('recipient', '00', '00')
+        chat_server.append_log('create_account', username='recipient', salt='00', pwhash='00').wait()
+        chat_server.snapshot()
+        chat_server.store_message('recipient', 'recipient', 'Once')
+        chat_server.append_log('store_message', sender='recipient', recipient='recipient', message='Once').wait()
+        log = bytes(chat_server.log_map[:chat_server.log_offset])
+        chat_server.snapshot()
+        chat_server.log_map[:len(log)] = log # the crash came before the mapped log was cleared
+        chat_server.log_map.flush()
+
+        restarted = self.restart()
+        self.assertEqual(list(restarted.accounts['recipient']['unread_messages']), [{'from': 'recipient', 'message': 'Once'}])
+
+    def test_restart_clears_torn_record(self):
+        """Test that the bytes of a record torn by a crash are zeroed, and the records before it are replayed."""
+        self.write_log(b'{"generation":0}\n{"op":"create_account","args":{"username":"a","salt":"00","pwhash":"00"}}\n'
+                       b'{"op":"create_account","args":{"username":"bob","sa')
+        chat_server = self.restart()
+        self.assertEqual(list(chat_server.accounts), ['a'])
+        self.assertEqual(chat_server.log_map[chat_server.log_offset:chat_server.log_offset + 32], bytes(32))
+
+    def test_restart_rejects_bad_record(self):
+        """Test that a complete record that cannot be applied stops startup."""
+        self.write_log(b'{"generation":0}\n{"op":"remove_account","args":{"username":"nobody"}}\n')
+        with self.assertRaises(KeyError):
+            self.restart()
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file